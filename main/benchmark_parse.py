@@ -0,0 +1,25 @@
+from twitter.page_archive import PageArchive
+from twitter.tweet_records import benchmark_page_parsing
+
+
+def main():
+    # Reprocess every archived page, see twitter/page_archive.py
+    archive = PageArchive()
+    pages = [record["page"] for record in archive.iter_records()]
+    print(f"Loaded {len(pages)} archived pages")
+
+    records_only = benchmark_page_parsing(pages)
+    print(
+        f"Records only: {records_only['tweets']} tweets in {records_only['seconds']:.3f}s "
+        f"({records_only['tweets_per_second']:,.0f} tweets/sec)"
+    )
+
+    with_models = benchmark_page_parsing(pages, build_models=True)
+    print(
+        f"Records + Tweet models: {with_models['tweets']} tweets in {with_models['seconds']:.3f}s "
+        f"({with_models['tweets_per_second']:,.0f} tweets/sec)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+from typing import Iterable
+from sqlmodel import SQLModel
+from db.database import NewsDatabase
+
+# A group is committed once it has this many objects...
+MAX_BATCH_SIZE = 500
+# ...or once its first object has waited this many seconds
+MAX_BATCH_DELAY = 0.25
+# Producers wait when this many objects are queued
+MAX_QUEUE_SIZE = 10_000
+
+
+class DatabaseWriterError(RuntimeError):
+    """Raised to producers once a commit of the writer failed"""
+
+
+class AsyncDatabaseWriter:
+    """
+    Single writer for async pipeline stages.
+
+    Producers put Tweet, Rank, Article, FetchState or LinkContent objects on a queue,
+    and one writer task commits them in groups on a worker thread. Only this task
+    writes, so concurrent producers never fight over SQLite's write lock, and the
+    event loop never waits on a commit.
+
+    Objects are committed in the order they were put, so saving a page's tweets
+    before its fetch state keeps the state from getting ahead of the tweets.
+
+    Usage:
+        async with AsyncDatabaseWriter(db) as writer:
+            await writer.put_many(tweets)
+    """
+
+    def __init__(
+        self,
+        db: NewsDatabase,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_batch_delay: float = MAX_BATCH_DELAY,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+    ):
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue: asyncio.Queue[SQLModel] = asyncio.Queue(max_queue_size)
+        self._task: asyncio.Task | None = None
+        self._error: Exception | None = None
+        self.committed = 0
+        # Objects thrown away after a failed commit
+        self.dropped = 0
+
+    async def __aenter__(self) -> "AsyncDatabaseWriter":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def start(self):
+        """Start the writer task on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, obj: SQLModel):
+        """Queue an object to be saved, waiting if the queue is full"""
+        self._raise_error()
+        await self._queue.put(obj)
+
+    async def put_many(self, objects: Iterable[SQLModel]):
+        """Queue several objects to be saved, in order"""
+        for obj in objects:
+            await self.put(obj)
+
+    async def flush(self):
+        """Wait until everything queued so far is committed (or dropped after a failure)"""
+        await self._queue.join()
+        self._raise_error()
+
+    async def close(self):
+        """Commit everything still queued and stop the writer task"""
+        if self._task is None:
+            return
+        try:
+            await self.flush()
+        finally:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _raise_error(self):
+        """Re-raise a commit error in the producers, so failures aren't silent"""
+        if self._error is not None:
+            raise DatabaseWriterError(
+                f"Database writer failed ({self.dropped} object(s) queued after it were dropped)"
+            ) from self._error
+
+    async def _next_batch(self) -> list[SQLModel]:
+        """Wait for an object, then gather more until the batch is full or the delay is up"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_batch_delay
+        while len(batch) < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        """
+        Commit queued objects in groups until cancelled.
+        After a failed commit nothing more is committed: the rest of the queue is
+        dropped, so e.g. a later fetch state can't get ahead of tweets that were lost.
+        """
+        while True:
+            batch = await self._next_batch()
+            try:
+                if self._error is not None:
+                    self.dropped += len(batch)
+                    continue
+                await asyncio.to_thread(self.db.save_objects, batch)
+                self.committed += len(batch)
+            except Exception as e:
+                print(f"Database writer failed to commit {len(batch)} object(s): {e}")
+                self._error = e
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -1,30 +1,185 @@
+import asyncio
+import os
 import sqlite3
-from datetime import datetime
-from typing import List, TypeVar, Type
+from datetime import datetime, timedelta
+from functools import lru_cache
+from collections import namedtuple
+from typing import Iterable, Iterator, List, Literal, TypeVar, Type
+from sqlalchemy import Engine, bindparam, event, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel import SQLModel, create_engine, Session, select
 
 # Import the SQLModel classes
 from pydantic_models.tweet_model import Tweet
 from pydantic_models.rank_model import Rank
 from pydantic_models.article_model import Article
+from pydantic_models.fetch_state_model import FetchState
+from pydantic_models.link_content_model import LinkContent
+from pydantic_models.prompt_template_model import PromptTemplate
+from pydantic_models.llm_cache_model import LLMCacheEntry
+from db.migrations import migrate
 
 # Used for the execute_query method
 T = TypeVar("T")
 
+# Row formats iter_query can return, besides a class to build
+RowType = Literal["tuple", "record", "dict", "arrow"]
+# Rows fetched from SQLite at a time when streaming a query
+FETCH_BATCH_SIZE = 1000
+
+# Database used by the pipeline, relative to the repo root
+DEFAULT_DB_PATH = "main/db/news_data.db"
+
+# Pragmas set on every new connection
+# WAL lets readers and a writer work at the same time, and with WAL synchronous=NORMAL
+# only syncs at checkpoints while staying safe against corruption
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # milliseconds
+    "mmap_size": 256 * 1024 * 1024,  # bytes
+    "cache_size": -64 * 1024,  # negative means KiB, so 64 MiB
+    "temp_store": "MEMORY",
+}
+
+# Columns refreshed when a tweet is saved again
+_TWEET_UPDATE_COLUMNS = [
+    "url",
+    "text",
+    "tweet_type",
+    "linked_tweet_id",
+    "retweet_count",
+    "reply_count",
+    "like_count",
+    "quote_count",
+    "view_count",
+    "bookmark_count",
+]
+_TWEET_UPDATE_SET = ", ".join(f"{c} = excluded.{c}" for c in _TWEET_UPDATE_COLUMNS)
+_TWEET_COLUMNS = ["tweet_id", "username", "created_at"] + _TWEET_UPDATE_COLUMNS
+
+# Tweets are keyed by their native ID, saving one again refreshes its row
+_TWEET_UPSERT = text(
+    f"""
+    INSERT INTO tweet ({", ".join(_TWEET_COLUMNS)})
+    VALUES ({", ".join(":" + c for c in _TWEET_COLUMNS)})
+    ON CONFLICT (tweet_id) DO UPDATE SET {_TWEET_UPDATE_SET}
+    RETURNING tweet_id
+    """
+).bindparams(bindparam("created_at", type_=Tweet.__table__.c.created_at.type))
+
+# A row saved before tweets were keyed by native ID (with a random UUID, so not all
+# digits) by the same user at the same time, when the tweet isn't saved under its ID yet
+_LEGACY_TWEET_LOOKUP = text(
+    """
+    SELECT tweet_id FROM tweet
+    WHERE username = :username AND created_at = :created_at
+    AND tweet_id GLOB '*[^0-9]*'
+    AND NOT EXISTS (SELECT 1 FROM tweet WHERE tweet_id = :tweet_id)
+    LIMIT 1
+    """
+).bindparams(bindparam("created_at", type_=Tweet.__table__.c.created_at.type))
+
+# Columns pointing at a tweet, repointed when a legacy row gets its native ID
+_TWEET_REFERENCES = [("tweet", "tweet_id"), ("rank", "tweet_id"), ("tweet", "linked_tweet_id")]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+@lru_cache(maxsize=None)
+def _get_engine(abs_db_path: str) -> Engine:
+    """Create the engine for a database file and bring its schema up to date"""
+    engine = create_engine(
+        f"sqlite:///{abs_db_path}",
+        # Pooled connections get handed to worker threads
+        connect_args={"check_same_thread": False},
+    )
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    SQLModel.metadata.create_all(engine)
+    # Bring databases created by older versions up to the current schema
+    migrate(engine)
+    return engine
+
+
+def get_engine(db_path: str = DEFAULT_DB_PATH) -> Engine:
+    """
+    Get the process-wide engine (and connection pool) for a database file.
+    The engine is created, and the tables created and migrated, on first use only.
+    """
+    return _get_engine(os.path.abspath(db_path))
+
+
+@lru_cache(maxsize=256)
+def _record_type(columns: tuple[str, ...]) -> type:
+    """Namedtuple class for a query's columns (invalid or duplicate names get renamed)"""
+    return namedtuple("Record", columns, rename=True)
+
+
+def _upsert_tweet(session: Session, tweet: Tweet) -> str:
+    """
+    Insert or update one tweet, returning the tweet_id it was saved under.
+    A legacy row of the same tweet is first re-keyed to the native ID, so it's updated
+    instead of copied. Only native IDs (all digits) are matched that way, two tweets
+    posted in the same second are still two rows.
+    """
+    row = {column: getattr(tweet, column) for column in _TWEET_COLUMNS}
+    if tweet.tweet_id.isdigit():
+        legacy_id = session.execute(_LEGACY_TWEET_LOOKUP, row).scalar()
+        if legacy_id is not None:
+            for table, column in _TWEET_REFERENCES:
+                session.execute(
+                    text(f"UPDATE {table} SET {column} = :new_id WHERE {column} = :old_id"),
+                    {"new_id": tweet.tweet_id, "old_id": legacy_id},
+                )
+    return session.execute(_TWEET_UPSERT, row).scalar_one()
+
+
+def _insert_models(
+    session: Session, table: Type[SQLModel], objects: List[SQLModel], update: bool
+) -> None:
+    """Insert a batch of objects of one table, updating or skipping existing rows"""
+    statement = sqlite_insert(table)
+    primary_key = [column.name for column in table.__table__.primary_key]
+    if update:
+        statement = statement.on_conflict_do_update(
+            index_elements=primary_key,
+            set_={
+                column.name: statement.excluded[column.name]
+                for column in table.__table__.columns
+                if column.name not in primary_key and column.computed is None
+            },
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=primary_key)
+    session.execute(statement, [obj.model_dump() for obj in objects])
+
+
+def _fts_match(query: str) -> str:
+    """Turn free text into an FTS5 query matching every word, quoting each word so
+    punctuation and words like OR or NOT aren't read as query syntax"""
+    words = query.split()
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
 
 class NewsDatabase:
     def __init__(self, db_path: str = "news_data.db"):
         """Initialize the database connection"""
         self.db_path = db_path
         self.connection = None
-        # Create SQLModel engine
-        self.engine = create_engine(f"sqlite:///{db_path}")
-        self.create_tables()
+        # Every NewsDatabase for the same file shares one engine
+        self.engine = get_engine(db_path)
 
     def connect(self):
         """Create a connection to the SQLite database"""
         self.connection = sqlite3.connect(self.db_path)
         self.connection.row_factory = sqlite3.Row
+        _set_sqlite_pragmas(self.connection, None)
         return self.connection
 
     def close(self):
@@ -36,6 +191,8 @@ class NewsDatabase:
     def create_tables(self):
         """Create the necessary tables using SQLModel"""
         SQLModel.metadata.create_all(self.engine)
+        # Bring databases created by older versions up to the current schema
+        migrate(self.engine)
 
     def tweet_exists(self, username: str, created_at: datetime) -> bool:
         """Check if a tweet already exists in the database based on username and creation time"""
@@ -51,24 +208,68 @@ class NewsDatabase:
         Save a Tweet object to the database
         Returns the tweet_id of the saved tweet
         """
-        # Check if tweet already exists
-        if self.tweet_exists(tweet.username, tweet.created_at):
-            with Session(self.engine) as session:
-                statement = select(Tweet).where(
-                    Tweet.username == tweet.username,
-                    Tweet.created_at == tweet.created_at,
-                )
-                existing_tweet = session.exec(statement).first()
-                if existing_tweet:
-                    return existing_tweet.tweet_id
+        return self.save_tweets([tweet])[0]
 
+    def save_tweets(self, tweets: Iterable[Tweet]) -> List[str]:
+        """
+        Insert or update a batch of tweets in one transaction.
+        Tweets are keyed by their native ID, so saving the same tweet again updates
+        its metrics instead of adding a copy. A tweet saved before that (with a random
+        UUID) is matched on username and creation time and moved to its native ID,
+        along with the ranks and tweets pointing at it.
+
+        Args:
+            tweets: Tweet objects to save
+
+        Returns:
+            The tweet_id each tweet was saved under, in the same order
+        """
         with Session(self.engine) as session:
-            session.add(tweet)
+            tweet_ids = [_upsert_tweet(session, tweet) for tweet in tweets]
             session.commit()
-            # Get the tweet_id while the session is still active
-            tweet_id = tweet.tweet_id
+        return tweet_ids
+
+    def save_objects(self, objects: Iterable[SQLModel]) -> None:
+        """
+        Save a mixed batch of objects in one transaction.
+        Tweets are upserted like in save_tweets, ranks, articles and prompt templates
+        are only inserted if they don't exist yet, anything else (fetch states, link
+        contents, LLM cache entries) is inserted or updated.
+        The objects aren't attached to a session, so callers can keep using them.
 
-        return tweet_id
+        Args:
+            objects: Tweet, Rank, Article, PromptTemplate, FetchState, LinkContent or
+                LLMCacheEntry objects to save
+        """
+        # Group the objects by table, so each table is written with one executemany
+        by_table = {}
+        for obj in objects:
+            by_table.setdefault(type(obj), []).append(obj)
+
+        with Session(self.engine) as session:
+            for table, table_objects in by_table.items():
+                if table is Tweet:
+                    for tweet in table_objects:
+                        _upsert_tweet(session, tweet)
+                else:
+                    # Ranks, articles and prompt templates never change once they're written
+                    update = table not in (Rank, Article, PromptTemplate)
+                    _insert_models(session, table, table_objects, update)
+            session.commit()
+
+    def save_ranks(self, ranks: Iterable[Rank]) -> None:
+        """Save a batch of ranks in one transaction (existing ranks are skipped)"""
+        self.save_objects(ranks)
+
+    def save_articles(self, articles: Iterable[Article]) -> None:
+        """Save a batch of articles in one transaction (existing articles are skipped)"""
+        self.save_objects(articles)
+
+    async def aexecute_query(
+        self, query: str, params: tuple = (), return_type: Type[T] = None
+    ) -> List[T]:
+        """Async version of execute_query, run on a worker thread with a pooled connection"""
+        return await asyncio.to_thread(self.execute_query, query, params, return_type)
 
     def rank_exists(self, rank_id: str) -> bool:
         """Check if a rank already exists in the database based on rank_id"""
@@ -94,6 +295,34 @@ class NewsDatabase:
 
         return rank_id
 
+    def get_fetch_state(self, username: str) -> FetchState | None:
+        """Get the incremental fetch state of a user, or None if the user was never fetched"""
+        with Session(self.engine) as session:
+            return session.get(FetchState, username)
+
+    def save_fetch_state(self, state: FetchState) -> None:
+        """Insert or update the incremental fetch state of a user"""
+        with Session(self.engine) as session:
+            session.merge(state)
+            session.commit()
+
+    def get_tweets_per_day(self, username: str, days: int = 14) -> float | None:
+        """
+        Average number of tweets per day posted by a user, over the days in the
+        last `days` days that have stored tweets. Returns None if there are none.
+        The username is compared as stored, so the (username, created_at) index is used.
+        """
+        since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+        query = """
+        SELECT count(*) AS tweet_count, count(DISTINCT created_date) AS day_count
+        FROM tweet
+        WHERE username = ? AND created_at >= ?;
+        """
+        row = self.execute_query(query, (username, since))[0]
+        if not row["day_count"]:
+            return None
+        return row["tweet_count"] / row["day_count"]
+
     def get_tweets_by_username(self, username: str, limit: int = 100) -> List[Tweet]:
         """Get tweets by username, ordered by creation date descending"""
         with Session(self.engine) as session:
@@ -106,6 +335,72 @@ class NewsDatabase:
             tweets = session.exec(statement).all()
             return list(tweets)
 
+    def get_tweets_by_ids(self, tweet_ids: list[str]) -> List[Tweet]:
+        """Get the stored tweets with the given IDs (IDs that aren't stored are skipped)"""
+        tweets = []
+        with Session(self.engine) as session:
+            # Stay under SQLite's limit on the number of query parameters
+            for i in range(0, len(tweet_ids), 500):
+                statement = select(Tweet).where(
+                    Tweet.tweet_id.in_(tweet_ids[i : i + 500])
+                )
+                tweets.extend(session.exec(statement).all())
+        return tweets
+
+    def get_link_contents(self, urls: list[str]) -> List[LinkContent]:
+        """Get the cached link contents for the given URLs (URLs that aren't cached are skipped)"""
+        link_contents = []
+        with Session(self.engine) as session:
+            # Stay under SQLite's limit on the number of query parameters
+            for i in range(0, len(urls), 500):
+                statement = select(LinkContent).where(
+                    LinkContent.url.in_(urls[i : i + 500])
+                )
+                link_contents.extend(session.exec(statement).all())
+        return link_contents
+
+    def save_link_contents(self, link_contents: List[LinkContent]) -> None:
+        """Insert or update a batch of link contents in one transaction"""
+        with Session(self.engine) as session:
+            for link_content in link_contents:
+                session.merge(link_content)
+            session.commit()
+
+    def search_tweets(
+        self,
+        query: str,
+        date_range: tuple[str, str] | None = None,
+        limit: int = 20,
+    ) -> List[Tweet]:
+        """
+        Full-text search over the stored tweets, best matches first (ranked by bm25).
+
+        Args:
+            query: Words to search for, every word has to match (words are stemmed,
+                so "upgrades" also finds "upgrade")
+            date_range: Optional (first day, last day) as "YYYY-MM-DD", inclusive
+            limit: Maximum number of tweets to return
+
+        Returns:
+            The matching tweets
+        """
+        match = _fts_match(query)
+        if not match:
+            return []
+
+        sql_query = """
+        SELECT tweet.* FROM tweet_fts
+        JOIN tweet ON tweet.rowid = tweet_fts.rowid
+        WHERE tweet_fts MATCH ?
+        """
+        params = [match]
+        if date_range is not None:
+            sql_query += " AND tweet.created_date BETWEEN ? AND ?"
+            params.extend(date_range)
+        sql_query += " ORDER BY bm25(tweet_fts) LIMIT ?"
+        params.append(limit)
+        return self.execute_query(sql_query, tuple(params), return_type=Tweet)
+
     def _format_sql_with_params(self, query: str, params: tuple) -> str:
         """Helper method to format SQL query with parameters for debugging"""
         if not params:
@@ -126,6 +421,69 @@ class NewsDatabase:
         """Get a new SQLModel session"""
         return Session(self.engine)
 
+    def iter_query(
+        self,
+        query: str,
+        params: tuple = (),
+        row_type: RowType | Type[T] = "record",
+        batch_size: int = FETCH_BATCH_SIZE,
+    ) -> Iterator:
+        """
+        Execute a SQL query and stream the results, fetching batch_size rows at a time.
+        Uses a pooled connection, which goes back to the pool once the iterator is
+        exhausted or closed.
+
+        Args:
+            query: SQL query string
+            params: Parameters for the query
+            row_type: How to return each row
+                - "tuple": plain tuples
+                - "record": namedtuples with the column names as fields
+                - "dict": dictionaries
+                - "arrow": one pyarrow.RecordBatch per fetched batch (needs pyarrow)
+                - a class: instances built from the row's columns, e.g. Tweet
+            batch_size: Number of rows fetched from SQLite at a time
+
+        Yields:
+            Rows (or Arrow record batches) in the requested format
+        """
+        if row_type == "arrow":
+            # pyarrow is optional, only needed for Arrow output
+            try:
+                import pyarrow as pa
+            except ImportError as e:
+                raise ImportError("Arrow output needs pyarrow: pip install pyarrow") from e
+
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description or ()]
+            if row_type == "record":
+                record = _record_type(tuple(columns))
+
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if row_type == "tuple":
+                    yield from rows
+                elif row_type == "record":
+                    yield from map(record._make, rows)
+                elif row_type == "dict":
+                    for row in rows:
+                        yield dict(zip(columns, row))
+                elif row_type == "arrow":
+                    yield pa.RecordBatch.from_arrays(
+                        [pa.array(values) for values in zip(*rows)], names=columns
+                    )
+                else:
+                    for row in rows:
+                        yield row_type(**dict(zip(columns, row)))
+            cursor.close()
+        finally:
+            conn.close()
+
     def execute_query(
         self, query: str, params: tuple = (), return_type: Type[T] = None
     ) -> List[T]:
@@ -135,36 +493,15 @@ class NewsDatabase:
         Args:
             query: SQL query string
             params: Parameters for the query
-            return_type: Class type to map results to
+            return_type: Class type to map results to (dictionaries if not given)
 
         Returns:
             List of objects of the specified type
         """
-        # For backward compatibility, fall back to raw SQLite for complex queries
-        conn = self.connect()
-        cursor = conn.cursor()
-
         # Print the formatted SQL query with parameters
         # print(f"Executing SQL:\n{self._format_sql_with_params(query, params)}")
 
-        cursor.execute(query, params)
-
-        rows = cursor.fetchall()
-
-        results = []
-        if return_type:
-            for row in rows:
-                # Convert row to dict
-                row_dict = dict(row)
-                # Create an instance of the return type with the row data
-                obj = return_type(**row_dict)
-                results.append(obj)
-        else:
-            # If no return type specified, return dictionaries
-            results = [dict(row) for row in rows]
-
-        self.close()
-        return results
+        return list(self.iter_query(query, params, return_type or "dict"))
 
     def article_exists(self, article_id: str) -> bool:
         """Check if an article already exists in the database based on article_id"""
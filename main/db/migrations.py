@@ -0,0 +1,219 @@
+from typing import Callable, List
+from sqlalchemy import Connection, Engine
+from pydantic_models.tweet_model import Tweet
+from pydantic_models.rank_model import Rank
+
+# Schema migrations, tracked in SQLite's PRAGMA user_version.
+# Migration N brings the schema to version N. Tables are created from the SQLModel
+# classes first, so every migration checks what's already there and skips what's done.
+# Only ever append to MIGRATIONS, never reorder or remove entries.
+
+
+def get_schema_version(conn: Connection) -> int:
+    """Read the schema version stored in the database"""
+    return conn.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+
+def _index_exists(conn: Connection, name: str) -> bool:
+    """Check if an index exists"""
+    return (
+        conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)
+        ).first()
+        is not None
+    )
+
+
+def _merge_duplicate_tweets(conn: Connection) -> None:
+    """
+    Version 1: add the (username, created_at) unique index to the tweet table.
+    Duplicate rows are merged into the oldest one first, repointing ranks and links.
+    """
+    if _index_exists(conn, "ix_tweet_username_created_at"):
+        return
+
+    conn.exec_driver_sql(
+        """
+        CREATE TEMP TABLE tweet_dupes AS
+        SELECT t.tweet_id AS old_id, k.tweet_id AS new_id
+        FROM tweet t
+        JOIN (
+            SELECT username, created_at, MIN(rowid) AS keep_rowid
+            FROM tweet GROUP BY username, created_at HAVING COUNT(*) > 1
+        ) g ON t.username = g.username AND t.created_at = g.created_at
+        JOIN tweet k ON k.rowid = g.keep_rowid
+        WHERE t.rowid != g.keep_rowid
+        """
+    )
+    for table, column in (("rank", "tweet_id"), ("tweet", "linked_tweet_id")):
+        conn.exec_driver_sql(
+            f"""
+            UPDATE {table} SET {column} = (
+                SELECT new_id FROM tweet_dupes WHERE old_id = {table}.{column}
+            )
+            WHERE {column} IN (SELECT old_id FROM tweet_dupes)
+            """
+        )
+    conn.exec_driver_sql(
+        "DELETE FROM tweet WHERE tweet_id IN (SELECT old_id FROM tweet_dupes)"
+    )
+    conn.exec_driver_sql("DROP TABLE tweet_dupes")
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX ix_tweet_username_created_at ON tweet (username, created_at)"
+    )
+
+
+def _add_created_date(conn: Connection) -> None:
+    """
+    Version 2: add the stored created_date column and its index to the tweet table.
+    SQLite can't add a stored generated column in place, so the table is rebuilt.
+    """
+    # table_xinfo also lists generated columns, table_info doesn't
+    columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_xinfo(tweet)")]
+    if "created_date" in columns:
+        return
+
+    # The indexes move with the renamed table, drop them so the new table can reuse the names
+    index_names = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'tweet' AND sql IS NOT NULL"
+    ).scalars().all()
+    for name in index_names:
+        conn.exec_driver_sql(f"DROP INDEX {name}")
+
+    conn.exec_driver_sql("ALTER TABLE tweet RENAME TO tweet_old")
+    Tweet.__table__.create(conn)
+    column_list = ", ".join(
+        column.name for column in Tweet.__table__.columns if column.computed is None
+    )
+    conn.exec_driver_sql(
+        f"INSERT INTO tweet ({column_list}) SELECT {column_list} FROM tweet_old"
+    )
+    conn.exec_driver_sql("DROP TABLE tweet_old")
+
+
+def _add_rank_indexes(conn: Connection) -> None:
+    """Version 3: index rank on tweet_id (for the tweet join) and on score"""
+    for index in Rank.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _add_tweet_fts(conn: Connection) -> None:
+    """
+    Version 4: add the tweet_fts full-text index over tweet.text.
+    It's an external content table (the text isn't stored twice) keyed by the tweet
+    table's rowid, kept in sync by triggers.
+    """
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tweet_fts'"
+    ).first()
+    if exists:
+        return
+
+    conn.exec_driver_sql(
+        """
+        CREATE VIRTUAL TABLE tweet_fts USING fts5(
+            text, content = 'tweet', content_rowid = 'rowid',
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    conn.exec_driver_sql(
+        """
+        CREATE TRIGGER tweet_fts_insert AFTER INSERT ON tweet BEGIN
+            INSERT INTO tweet_fts (rowid, text) VALUES (new.rowid, new.text);
+        END
+        """
+    )
+    conn.exec_driver_sql(
+        """
+        CREATE TRIGGER tweet_fts_delete AFTER DELETE ON tweet BEGIN
+            INSERT INTO tweet_fts (tweet_fts, rowid, text)
+            VALUES ('delete', old.rowid, old.text);
+        END
+        """
+    )
+    # Saving a tweet again rewrites its text, only reindex it when the text changed
+    conn.exec_driver_sql(
+        """
+        CREATE TRIGGER tweet_fts_update AFTER UPDATE OF text ON tweet
+        WHEN old.text IS NOT new.text BEGIN
+            INSERT INTO tweet_fts (tweet_fts, rowid, text)
+            VALUES ('delete', old.rowid, old.text);
+            INSERT INTO tweet_fts (rowid, text) VALUES (new.rowid, new.text);
+        END
+        """
+    )
+    rebuild_tweet_fts(conn)
+
+
+def _add_prompt_columns(conn: Connection) -> None:
+    """
+    Version 5: add prompt_version and prompt_inputs to rank and article.
+    New rows reference a prompt_template row instead of storing the full prompt.
+    """
+    for table in ("rank", "article"):
+        columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+        if "prompt_version" not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN prompt_version VARCHAR")
+        if "prompt_inputs" not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN prompt_inputs JSON")
+
+
+def _relax_tweet_time_index(conn: Connection) -> None:
+    """
+    Version 6: make the (username, created_at) index of the tweet table non-unique.
+    Tweets are keyed by their native ID, and two can share a second.
+    """
+    sql = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?",
+        ("ix_tweet_username_created_at",),
+    ).scalar()
+    if sql is not None and "UNIQUE" not in sql.upper():
+        return
+
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_tweet_username_created_at")
+    conn.exec_driver_sql(
+        "CREATE INDEX ix_tweet_username_created_at ON tweet (username, created_at)"
+    )
+
+
+def rebuild_tweet_fts(conn: Connection) -> None:
+    """
+    Rebuild the full-text index from the tweet table.
+    Needed after VACUUM, which can renumber the rowids the index points at.
+    """
+    conn.exec_driver_sql("INSERT INTO tweet_fts (tweet_fts) VALUES ('rebuild')")
+
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _merge_duplicate_tweets,
+    _add_created_date,
+    _add_rank_indexes,
+    _add_tweet_fts,
+    _add_prompt_columns,
+    _relax_tweet_time_index,
+]
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Bring the database schema up to the latest version.
+    Each migration runs in its own transaction together with its version bump.
+
+    Returns:
+        The schema version of the database
+    """
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+
+    for version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with engine.begin() as conn:
+            # Start the transaction before the DDL, which SQLite can roll back
+            conn.exec_driver_sql("SAVEPOINT migration")
+            migration(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+            conn.exec_driver_sql("RELEASE migration")
+        print(f"Migrated database schema to version {version}")
+
+    return version
@@ -0,0 +1,228 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from sqlalchemy import Boolean, DateTime, Float, Integer
+from sqlmodel import SQLModel
+from db.database import NewsDatabase
+from db.migrations import rebuild_tweet_fts
+from pydantic_models.tweet_model import Tweet
+from pydantic_models.rank_model import Rank
+
+# Old tweets and ranks are moved to <archive dir>/<table>/created_date=YYYY-MM-DD/*.parquet
+DEFAULT_PARQUET_DIR = Path(__file__).parent / "parquet_archive"
+
+# Tweets still linked from tweets that stay in the database stay too, the ranker reads
+# them as context
+_ARCHIVABLE_TWEETS = """
+    tweet.created_date = ?
+    AND tweet.tweet_id NOT IN (
+        SELECT linked_tweet_id FROM tweet
+        WHERE created_date >= ? AND linked_tweet_id IS NOT NULL
+    )
+"""
+
+
+def _import_pyarrow():
+    """pyarrow is optional, only needed for the Parquet archive"""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The Parquet archive needs pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def _arrow_schema(pa, table: type[SQLModel]):
+    """Arrow schema for a table's columns (created_date is the partition, it's left out)"""
+    arrow_types = [
+        (Boolean, pa.bool_()),
+        (Integer, pa.int64()),
+        (Float, pa.float64()),
+        (DateTime, pa.timestamp("us")),
+    ]
+
+    def arrow_type(column):
+        for column_type, arrow_type in arrow_types:
+            if isinstance(column.type, column_type):
+                return arrow_type
+        return pa.string()
+
+    return pa.schema(
+        [
+            (column.name, arrow_type(column))
+            for column in table.__table__.columns
+            if column.name != "created_date"
+        ]
+    )
+
+
+def _write_partition(
+    pa, db: NewsDatabase, table: type[SQLModel], query: str, params: tuple, path: Path
+) -> int:
+    """
+    Stream a query's rows into a new zstd-compressed Parquet file in the partition.
+
+    Returns:
+        The number of rows written (no file is left behind if there are none)
+    """
+    schema = _arrow_schema(pa, table)
+    path.mkdir(parents=True, exist_ok=True)
+    # Every archive run adds a new part file, so reruns never overwrite older parts
+    part_path = path / f"part-{time.time_ns()}.parquet"
+    # Readers skip dot files, so a half-written part is never read
+    tmp_path = path / f".{part_path.name}.tmp"
+
+    rows = 0
+    with pa.parquet.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+        for batch in db.iter_query(query, params, row_type="arrow"):
+            writer.write_batch(batch.cast(schema))
+            rows += batch.num_rows
+    if rows:
+        os.replace(tmp_path, part_path)
+    else:
+        tmp_path.unlink()
+        if not any(path.iterdir()):
+            path.rmdir()
+    return rows
+
+
+def archive_old_rows(
+    db: NewsDatabase,
+    older_than_days: int,
+    archive_dir: Path = DEFAULT_PARQUET_DIR,
+    vacuum: bool = True,
+) -> dict[str, int]:
+    """
+    Move tweets (and their ranks) older than the given number of days out of the
+    database into day-partitioned Parquet files, then vacuum the database.
+
+    Each day is written to Parquet first and only deleted from the database once its
+    files are in place, one transaction per day.
+
+    Args:
+        db: Database to archive from
+        older_than_days: Tweets created before this many days ago (UTC) are archived
+        archive_dir: Root directory of the Parquet archive
+        vacuum: Reclaim the freed space afterwards
+
+    Returns:
+        Number of archived rows per table
+    """
+    pa = _import_pyarrow()
+    if older_than_days < 1:
+        raise ValueError("older_than_days has to be at least 1")
+
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime(
+        "%Y-%m-%d"
+    )
+    days = [
+        row[0]
+        for row in db.iter_query(
+            "SELECT DISTINCT created_date FROM tweet WHERE created_date < ? ORDER BY 1",
+            (cutoff,),
+            row_type="tuple",
+        )
+    ]
+
+    tweet_columns = ", ".join(
+        f"tweet.{name}" for name in _arrow_schema(pa, Tweet).names
+    )
+    rank_columns = ", ".join(f"rank.{name}" for name in _arrow_schema(pa, Rank).names)
+    counts = {"tweet": 0, "rank": 0}
+    for day in days:
+        params = (day, cutoff)
+        partition = f"created_date={day}"
+        counts["rank"] += _write_partition(
+            pa,
+            db,
+            Rank,
+            f"SELECT {rank_columns} FROM rank JOIN tweet ON rank.tweet_id = tweet.tweet_id "
+            f"WHERE {_ARCHIVABLE_TWEETS}",
+            params,
+            Path(archive_dir) / "rank" / partition,
+        )
+        counts["tweet"] += _write_partition(
+            pa,
+            db,
+            Tweet,
+            f"SELECT {tweet_columns} FROM tweet WHERE {_ARCHIVABLE_TWEETS}",
+            params,
+            Path(archive_dir) / "tweet" / partition,
+        )
+
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "DELETE FROM rank WHERE tweet_id IN "
+                f"(SELECT tweet_id FROM tweet WHERE {_ARCHIVABLE_TWEETS})",
+                params,
+            )
+            conn.exec_driver_sql(f"DELETE FROM tweet WHERE {_ARCHIVABLE_TWEETS}", params)
+        print(f"Archived {day}")
+
+    print(
+        f"Archived {counts['tweet']} tweet(s) and {counts['rank']} rank(s) "
+        f"from {len(days)} day(s) before {cutoff} to {archive_dir}"
+    )
+
+    if vacuum and counts["tweet"]:
+        vacuum_database(db)
+    return counts
+
+
+def vacuum_database(db: NewsDatabase) -> None:
+    """Reclaim free space, then rebuild the full-text index and shrink the WAL file"""
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+    with db.engine.begin() as conn:
+        # VACUUM can renumber the rowids the full-text index points at
+        rebuild_tweet_fts(conn)
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def read_archive(
+    table: str,
+    start_date: str | None = None,
+    end_date: str | None = None,
+    filter=None,
+    columns: list[str] | None = None,
+    archive_dir: Path = DEFAULT_PARQUET_DIR,
+):
+    """
+    Read archived rows as a pyarrow Table.
+    The date range only opens the matching day partitions, and the filter is pushed
+    down to the Parquet row groups, so only the needed data is read.
+
+    Args:
+        table: "tweet" or "rank"
+        start_date: First day to read, "YYYY-MM-DD" (inclusive)
+        end_date: Last day to read, "YYYY-MM-DD" (inclusive)
+        filter: Extra pyarrow.dataset expression, e.g. ds.field("username") == "VitalikButerin"
+        columns: Columns to read (all of them if not given)
+        archive_dir: Root directory of the Parquet archive
+
+    Returns:
+        pyarrow.Table with the matching rows, including the created_date partition column
+    """
+    pa = _import_pyarrow()
+    ds = pa.dataset
+
+    path = Path(archive_dir) / table
+    if not path.exists():
+        raise FileNotFoundError(f"No archived {table} rows in {archive_dir}")
+
+    partitioning = ds.partitioning(
+        pa.schema([("created_date", pa.string())]), flavor="hive"
+    )
+    dataset = ds.dataset(path, format="parquet", partitioning=partitioning)
+
+    expression = filter
+    for bound in (
+        ds.field("created_date") >= start_date if start_date else None,
+        ds.field("created_date") <= end_date if end_date else None,
+    ):
+        if bound is not None:
+            expression = bound if expression is None else expression & bound
+    return dataset.to_table(columns=columns, filter=expression)
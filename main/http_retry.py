@@ -0,0 +1,61 @@
+"""
+Retry policy shared by the HTTP clients (twitterapi.io and the LLM providers):
+which statuses are worth retrying, how to read Retry-After and how long to back off.
+"""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping
+
+# Status codes worth retrying: rate limited (429), timeouts, conflicts and transient
+# server errors, including the ones Cloudflare answers for an unreachable origin
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 520, 522, 524, 529}
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float | None:
+    """
+    Read how long the server asked to wait, from retry-after-ms or from Retry-After
+    given either in seconds or as an HTTP date.
+
+    Args:
+        headers: Response headers (looked up case-insensitively by httpx)
+
+    Returns:
+        Seconds to wait, or None if the headers are missing or invalid
+    """
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def backoff_delay(
+    attempt: int,
+    base: float = 1.0,
+    cap: float = 60.0,
+    retry_after: float | None = None,
+) -> float:
+    """
+    Exponential backoff with full jitter for the given (0-based) retry attempt.
+    With a Retry-After, wait that long plus up to a second, so callers told the same
+    time don't all retry at once.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1)
+    return random.uniform(0, min(cap, base * 2**attempt))
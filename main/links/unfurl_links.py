@@ -0,0 +1,328 @@
+import asyncio
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List
+from urllib.parse import urlparse
+import httpx
+from bs4 import BeautifulSoup
+from db.database import NewsDatabase
+from pydantic_models.link_content_model import LinkContent
+from pydantic_models.tweet_model import Tweet
+
+# Cached link contents are refetched after this long (failed fetches retry sooner)
+LINK_TTL = timedelta(days=7)
+FAILED_LINK_TTL = timedelta(days=1)
+
+# Pages fetched at once, overall and per domain
+MAX_CONCURRENCY = 20
+MAX_PER_DOMAIN = 2
+
+# Keep the stored text and the prompt summaries short
+MAX_TEXT_CHARS = 20000
+SUMMARY_CHARS = 500
+# Only this much of a page is downloaded, its text is near the top and markup is bulky
+MAX_PAGE_BYTES = 1024 * 1024
+
+# Short link services we resolve before fetching, so every alias of a page is fetched once
+SHORTENER_DOMAINS = {"t.co", "bit.ly", "buff.ly", "ow.ly", "tinyurl.com"}
+# Tweets, photos and profiles need a login, there's nothing to extract
+SKIP_DOMAINS = {"x.com", "twitter.com", "www.x.com", "www.twitter.com"}
+
+URL_PATTERN = re.compile(r"https?://[^\s<>\"']+")
+# Punctuation that ends a sentence rather than the URL
+TRAILING_PUNCTUATION = ".,;:!?)]}…"
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; TwitterNewsBot/1.0)",
+    "Accept": "text/html,application/xhtml+xml",
+}
+
+
+def _utc_now() -> datetime:
+    """Current time as naive UTC, matching the database"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _domain(url: str) -> str:
+    """Lower-cased host of a URL"""
+    return (urlparse(url).hostname or "").lower()
+
+
+def extract_urls(text: str) -> List[str]:
+    """Find the URLs in a tweet's text, in order and without duplicates"""
+    urls = []
+    for match in URL_PATTERN.findall(text or ""):
+        url = match.rstrip(TRAILING_PUNCTUATION)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def collect_tweet_urls(tweets: Iterable[Tweet]) -> dict[str, List[str]]:
+    """
+    Gather the URLs of a batch of tweets, deduplicated across tweets.
+
+    Returns:
+        Dictionary mapping each URL to the IDs of the tweets that contain it
+    """
+    urls = defaultdict(list)
+    for tweet in tweets:
+        for url in extract_urls(tweet.text):
+            urls[url].append(tweet.tweet_id)
+    return dict(urls)
+
+
+def is_fresh(link_content: LinkContent, ttl: timedelta = LINK_TTL) -> bool:
+    """Check if a cached link content is still within its TTL"""
+    if link_content.error:
+        ttl = min(ttl, FAILED_LINK_TTL)
+    return link_content.fetched_at > _utc_now() - ttl
+
+
+def extract_page_text(html: str) -> tuple[str | None, str]:
+    """
+    Extract the title and main text of an HTML page.
+    Prefers the <article> or <main> element and drops navigation, scripts and styles.
+
+    Returns:
+        Tuple of (title, text)
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text(strip=True) if soup.title else None
+
+    for element in soup(["script", "style", "noscript", "nav", "header", "footer", "aside", "form"]):
+        element.decompose()
+
+    root = soup.find("article") or soup.find("main") or soup.body or soup
+    paragraphs = [p.get_text(" ", strip=True) for p in root.find_all("p")]
+    text = "\n".join(p for p in paragraphs if p)
+    if not text:
+        # Pages without paragraphs, fall back to all visible text
+        text = root.get_text(" ", strip=True)
+    return title, text[:MAX_TEXT_CHARS]
+
+
+def summarize_text(text: str, max_chars: int = SUMMARY_CHARS) -> str:
+    """Summarize extracted text with its opening sentences, cut at a word boundary"""
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut + "..."
+
+
+async def resolve_url(client: httpx.AsyncClient, url: str, max_hops: int = 5) -> str:
+    """Follow a short link's redirects without requesting the page behind it"""
+    for _ in range(max_hops):
+        if _domain(url) not in SHORTENER_DOMAINS:
+            break
+        try:
+            response = await client.head(url)
+        except httpx.HTTPError:
+            # Let the page fetch follow the redirect instead
+            break
+        location = response.headers.get("location")
+        if not response.is_redirect or not location:
+            break
+        url = str(response.url.join(location))
+    return url
+
+
+async def fetch_link(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    domain_semaphores: dict[str, asyncio.Semaphore],
+    url: str,
+) -> LinkContent:
+    """
+    Fetch a page and extract its text, limited overall and per domain.
+    The response is streamed: failed and non-HTML responses are rejected from their
+    headers without downloading the body, and at most MAX_PAGE_BYTES are read.
+    Errors are recorded on the LinkContent instead of being raised.
+    """
+    domain = _domain(url)
+    body = bytearray()
+    # Wait for the domain first, so a global slot is only held by a fetch that can run
+    async with domain_semaphores[domain]:
+        async with semaphore:
+            try:
+                async with client.stream("GET", url, follow_redirects=True) as response:
+                    link_content = LinkContent(
+                        url=url,
+                        final_url=str(response.url),
+                        status_code=response.status_code,
+                    )
+                    content_type = response.headers.get("content-type", "")
+                    if response.status_code != 200:
+                        link_content.error = f"HTTP {response.status_code}"
+                        return link_content
+                    if "html" not in content_type:
+                        link_content.error = f"Not an HTML page: {content_type}"
+                        return link_content
+                    async for chunk in response.aiter_bytes():
+                        body.extend(chunk)
+                        if len(body) >= MAX_PAGE_BYTES:
+                            break
+                    encoding = response.charset_encoding or "utf-8"
+            except httpx.HTTPError as e:
+                return LinkContent(
+                    url=url, final_url=url, error=f"{type(e).__name__}: {e}"
+                )
+
+    try:
+        html = body[:MAX_PAGE_BYTES].decode(encoding, errors="replace")
+    except LookupError:
+        # Unknown charset in the headers
+        html = body[:MAX_PAGE_BYTES].decode("utf-8", errors="replace")
+    title, text = extract_page_text(html)
+    link_content.title = title
+    link_content.text = text
+    link_content.summary = summarize_text(text)
+    return link_content
+
+
+async def unfurl_links_async(
+    db: NewsDatabase,
+    tweets: Iterable[Tweet],
+    ttl: timedelta = LINK_TTL,
+    max_concurrency: int = MAX_CONCURRENCY,
+    max_per_domain: int = MAX_PER_DOMAIN,
+) -> dict[str, LinkContent]:
+    """
+    Fetch and store the text behind every link in a batch of tweets.
+
+    Links are deduplicated across tweets, and links cached in the link_content table
+    within their TTL aren't fetched again. Short links are resolved first, so a page
+    shared through several short links is only fetched once.
+
+    Args:
+        db: Database holding the link_content cache
+        tweets: Tweets to unfurl the links of
+        ttl: How long a cached link content stays fresh
+        max_concurrency: Maximum number of pages fetched at once
+        max_per_domain: Maximum number of pages fetched at once from one domain
+
+    Returns:
+        Dictionary mapping each URL found in the tweets to its LinkContent
+    """
+    urls = list(collect_tweet_urls(tweets))
+    if not urls:
+        return {}
+
+    link_contents = {
+        link_content.url: link_content
+        for link_content in db.get_link_contents(urls)
+        if is_fresh(link_content, ttl)
+    }
+    to_fetch = [url for url in urls if url not in link_contents]
+    if not to_fetch:
+        return link_contents
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    domain_semaphores = defaultdict(lambda: asyncio.Semaphore(max_per_domain))
+    async with httpx.AsyncClient(
+        headers=HEADERS,
+        timeout=15.0,
+        limits=httpx.Limits(max_connections=max_concurrency),
+    ) as client:
+
+        async def resolve(url: str) -> str:
+            # Redirect lookups are cheap, so they only count against the overall limit
+            async with semaphore:
+                return await resolve_url(client, url)
+
+        final_urls = await asyncio.gather(*(resolve(url) for url in to_fetch))
+
+        # Group the aliases of each page, reusing any fresh cached copy of it
+        aliases = defaultdict(list)
+        for url, final_url in zip(to_fetch, final_urls):
+            aliases[final_url].append(url)
+        cached_pages = {
+            link_content.url: link_content
+            for link_content in db.get_link_contents(list(aliases))
+            if is_fresh(link_content, ttl)
+        }
+        pages = [
+            final_url
+            for final_url in aliases
+            if final_url not in cached_pages and _domain(final_url) not in SKIP_DOMAINS
+        ]
+        fetched = await asyncio.gather(
+            *(fetch_link(client, semaphore, domain_semaphores, page) for page in pages)
+        )
+
+    pages_by_url = dict(cached_pages)
+    pages_by_url.update(zip(pages, fetched))
+    to_save = list(fetched)
+    for final_url, page_aliases in aliases.items():
+        page = pages_by_url.get(final_url)
+        for url in page_aliases:
+            if url == final_url and page is not None:
+                link_contents[url] = page
+                continue
+            # Store every alias with the page's content, so it's a cache hit next time
+            alias = LinkContent(url=url, final_url=final_url)
+            if page is None:
+                alias.error = "Skipped: page needs a login"
+            else:
+                alias.title = page.title
+                alias.text = page.text
+                alias.summary = page.summary
+                alias.status_code = page.status_code
+                alias.error = page.error
+            link_contents[url] = alias
+            to_save.append(alias)
+
+    db.save_link_contents(to_save)
+    print(
+        f"Unfurled {len(urls)} link(s): {len(urls) - len(to_fetch)} cached, "
+        f"{len(pages)} page(s) fetched"
+    )
+    return link_contents
+
+
+def unfurl_links(
+    db: NewsDatabase,
+    tweets: Iterable[Tweet],
+    ttl: timedelta = LINK_TTL,
+    max_concurrency: int = MAX_CONCURRENCY,
+    max_per_domain: int = MAX_PER_DOMAIN,
+) -> dict[str, LinkContent]:
+    """Synchronous entry point for unfurl_links_async."""
+    return asyncio.run(
+        unfurl_links_async(db, tweets, ttl, max_concurrency, max_per_domain)
+    )
+
+
+def get_link_summaries(
+    db: NewsDatabase, tweets: Iterable[Tweet]
+) -> dict[str, List[LinkContent]]:
+    """
+    Get the cached link contents of each tweet, without fetching anything.
+
+    Returns:
+        Dictionary mapping tweet IDs to the LinkContents (with a summary) of their links
+    """
+    tweet_urls = collect_tweet_urls(tweets)
+    link_contents = {
+        link_content.url: link_content
+        for link_content in db.get_link_contents(list(tweet_urls))
+    }
+    summaries = defaultdict(list)
+    for url, tweet_ids in tweet_urls.items():
+        link_content = link_contents.get(url)
+        if link_content is None or not link_content.summary:
+            continue
+        for tweet_id in tweet_ids:
+            summaries[tweet_id].append(link_content)
+    return dict(summaries)
+
+
+def format_link_summaries(link_contents: Iterable[LinkContent]) -> str:
+    """Format link summaries for a prompt, one line per link"""
+    lines = []
+    for link_content in link_contents:
+        title = link_content.title or _domain(link_content.final_url or link_content.url)
+        lines.append(f"- {title} ({link_content.final_url}): {link_content.summary}")
+    return "\n".join(lines)
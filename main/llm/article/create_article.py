@@ -1,20 +1,27 @@
-from db.database import NewsDatabase
+from db.database import NewsDatabase, DEFAULT_DB_PATH
 from pydantic_models.tweet_model import Tweet
 from pydantic_models.rank_model import Rank
 from pydantic_models.article_model import Article
 from pydantic_models.article_plan_model import ArticlePlan
 from pydantic_models.llm_article_model import LLMArticle, LLMArticleV2
 import pandas as pd
+from pydantic import BaseModel
 import os
 from pydantic_ai import Agent
 from pydantic_ai.models.openai import OpenAIChatModel
-from pydantic_ai.providers.openai import OpenAIProvider
-import jinja2
 import pathlib
 from datetime import datetime
 from typing import Optional
-from llm.open_router import create_openrouter_model, get_model_display_name, ModelType
+from llm.open_router import (
+    create_openai_provider,
+    create_openrouter_model,
+    get_model_display_name,
+    ModelType,
+)
 from llm.call_llm import call_llm_with_retry
+from llm.prompt_registry import get_prompt
+from llm.llm_cache import LLMCache, cache_key
+from links.unfurl_links import get_link_summaries, format_link_summaries
 
 # Local model configuration (only used when needed)
 model_name = "qwen3:14b_t0"
@@ -24,7 +31,7 @@ def collect_tweets_for_article(
     rank_list: list[Rank] | None = None, run_date: str = None
 ) -> pd.DataFrame:
     # Initialize the database
-    db = NewsDatabase("main/db/news_data.db")
+    db = NewsDatabase(DEFAULT_DB_PATH)
 
     print(f"Collecting tweets for article from date: {run_date}")
 
@@ -32,17 +39,17 @@ def collect_tweets_for_article(
         # Pull in all ranks from the specific date with score >= 7
         # Join on the tweets table to pull based on when the tweets were created
         # (and not when the rank was run)
-        sql_query = f"""
-        SELECT rank.rank_id, rank.tweet_id, rank.run_time, rank.reason, rank.score, rank.model, rank.prompt
+        sql_query = """
+        SELECT rank.rank_id, rank.tweet_id, rank.run_time, rank.reason, rank.score, rank.model, rank.prompt_version
         FROM rank
         join tweet on rank.tweet_id = tweet.tweet_id
-        WHERE date(tweet.created_at) = '{run_date}'
+        WHERE tweet.created_date = ?
         AND rank.score >= 7
         ORDER BY rank.score DESC
         LIMIT 10;
         """
 
-        rank_list = db.execute_query(sql_query, return_type=Rank)
+        rank_list = db.execute_query(sql_query, (run_date,), return_type=Rank)
         print(f"Retrieved {len(rank_list)} high-scoring ranks from date: {run_date}")
 
     if not rank_list or len(rank_list) == 0:
@@ -62,6 +69,9 @@ def collect_tweets_for_article(
     tweets = db.execute_query(tweet_query, params=tweet_ids, return_type=Tweet)
     print(f"Retrieved {len(tweets)} tweets referenced by the high-scoring ranks")
 
+    # Summaries of the pages the tweets link to (fetched while ranking)
+    link_summaries = get_link_summaries(db, tweets)
+
     # Create dictionaries from tweets and ranks for DataFrame creation
     tweets_dict = {tweet.tweet_id: tweet.__dict__ for tweet in tweets}
     ranks_dict = {
@@ -76,6 +86,9 @@ def collect_tweets_for_article(
             # Combine tweet data with rank data
             combined_row = tweet_data.copy()
             combined_row.update(ranks_dict[tweet_id])
+            combined_row["link_summary"] = format_link_summaries(
+                link_summaries.get(tweet_id, [])
+            )
             combined_data.append(combined_row)
 
     # Create DataFrame with combined data
@@ -100,6 +113,8 @@ def format_tweet_sources(tweets_df: pd.DataFrame) -> str:
             f"Link: {tweet_url}\n"
             f"Score: {row.get('rank_score', 0)}\n"
         )
+        if row.get("link_summary"):
+            tweet_info += f"Linked pages:\n{row.get('link_summary')}\n"
         tweet_sources.append(tweet_info)
 
     # Join all tweet sources into a single string
@@ -111,8 +126,8 @@ def get_tweet_sources_by_ids(tweet_ids: list[str]) -> list[dict]:
     if not tweet_ids:
         return []
 
-    # Initialize the database
-    db = NewsDatabase("main/db/news_data.db")
+    # Cheap to call per paragraph, every NewsDatabase shares the same engine
+    db = NewsDatabase(DEFAULT_DB_PATH)
 
     # Query for the tweets using these IDs
     placeholders = ",".join(["?" for _ in tweet_ids])
@@ -151,50 +166,75 @@ def format_paragraph_sources(sources: list[dict]) -> str:
     return "Sources:\n" + "\n".join(source_lines) + "\n\n"
 
 
-def generate_article_plan(
-    tweets_df: pd.DataFrame, article_model_type: Optional[ModelType] = None, ollama_host: Optional[str] = None
-) -> ArticlePlan:
-    """Generate a structured plan for the article using the tweet data."""
-    # Format tweet information
-    sources = format_tweet_sources(tweets_df)
-
-    # Load the planning Jinja template
-    template_path = pathlib.Path(__file__).parent / "article_plan_prompt.jinja"
-    with open(template_path, "r") as f:
-        template_content = f.read()
+def get_article_model_name(article_model_type: Optional[ModelType] = None) -> str:
+    """The name of the model articles are written with"""
+    if article_model_type:
+        return get_model_display_name(article_model_type)
+    return model_name
 
-    # Render the template
-    jinja_env = jinja2.Environment()
-    template = jinja_env.from_string(template_content)
-    prompt = template.render(sources=sources)
 
-    # Make LLM call for planning
+def create_article_agent(
+    output_type: type[BaseModel],
+    prompt: str,
+    article_model_type: Optional[ModelType] = None,
+    ollama_host: Optional[str] = None,
+) -> Agent:
+    """Create the agent for an article step, with the rendered prompt as its system prompt."""
     if article_model_type:
         # Use OpenRouter with specified model type
-        openrouter_model = create_openrouter_model(article_model_type)
-        agent = Agent(
+        # call_llm_with_retry does the retries, so it sees every rate limit
+        openrouter_model = create_openrouter_model(article_model_type, max_retries=0)
+        return Agent(
             model=openrouter_model,
-            output_type=ArticlePlan,
+            output_type=output_type,
             system_prompt=prompt,
             retries=3,
         )
-    else:
-        # Initialize the local Ollama model
-        if not ollama_host:
-            raise ValueError("ollama_host parameter is required to use local models. Please provide it (e.g., 'http://localhost:11434')")
-        
-        full_url = f"{ollama_host}/v1"
-        ollama_model = OpenAIChatModel(
-            model_name=model_name,
-            provider=OpenAIProvider(base_url=full_url),
-        )
-        agent = Agent(
-            model=ollama_model, output_type=ArticlePlan, system_prompt=prompt, retries=3
-        )
+
+    # Use the local Ollama model if no model type is provided
+    if not ollama_host:
+        raise ValueError("ollama_host parameter is required to use local models. Please provide it (e.g., 'http://localhost:11434')")
+
+    full_url = f"{ollama_host}/v1"
+    ollama_model = OpenAIChatModel(
+        model_name=model_name,
+        provider=create_openai_provider(full_url, max_retries=0),
+    )
+    return Agent(
+        model=ollama_model, output_type=output_type, system_prompt=prompt, retries=3
+    )
+
+
+def generate_article_plan(
+    tweets_df: pd.DataFrame,
+    article_model_type: Optional[ModelType] = None,
+    ollama_host: Optional[str] = None,
+    cache: Optional[LLMCache] = None,
+) -> ArticlePlan:
+    """Generate a structured plan for the article using the tweet data (reused from the cache when given)."""
+    # Format tweet information
+    sources = format_tweet_sources(tweets_df)
+
+    # Render the planning Jinja template (compiled once per run)
+    plan_prompt = get_prompt("article/article_plan_prompt.jinja")
+    prompt = plan_prompt.render(sources=sources)
+
+    # The same sources with the same model and prompt give the cached plan
+    current_model = get_article_model_name(article_model_type)
+    key = cache_key(current_model, plan_prompt.version, ArticlePlan, {"sources": sources})
+    plan = cache.get(key, ArticlePlan) if cache is not None else None
+    if plan is not None:
+        print(f"Using cached article plan with daily summary: {plan.daily_summary}")
+        return plan
+
+    # Make LLM call for planning
+    agent = create_article_agent(ArticlePlan, prompt, article_model_type, ollama_host)
 
     # Run the agent and get the plan with retry logic
     result = call_llm_with_retry(agent.run_sync, prompt)
     plan = result.output
+    if cache is not None:
+        cache.put(key, current_model, plan_prompt.version, plan)
     print(f"Generated article plan with daily summary: {plan.daily_summary}")
     # print(f"Article plan top stories: {plan.top_stories}")
     # print(f"Article plan structure: {plan.structure}")
@@ -336,70 +376,57 @@ def save_article_v2_to_markdown(
 
 
 def create_article(
-    tweets_df: pd.DataFrame, article_model_type: Optional[ModelType] = None, ollama_host: Optional[str] = None
+    tweets_df: pd.DataFrame,
+    article_model_type: Optional[ModelType] = None,
+    ollama_host: Optional[str] = None,
+    cache: Optional[LLMCache] = None,
 ) -> Article:
-    """Create an article using a two-step process: planning and generation."""
+    """Create an article using a two-step process: planning and generation (both reused from the cache when given)."""
     # Step 1: Generate an article plan
-    plan = generate_article_plan(tweets_df, article_model_type, ollama_host)
+    plan = generate_article_plan(tweets_df, article_model_type, ollama_host, cache)
 
     # Step 2: Generate the full article using the plan
     sources = format_tweet_sources(tweets_df)
 
-    # Load the article generation Jinja template
-    template_path = pathlib.Path(__file__).parent / "article_prompt_v2.jinja"
-    with open(template_path, "r") as f:
-        template_content = f.read()
-
-    # Render the template with both sources and plan
-    jinja_env = jinja2.Environment()
-    template = jinja_env.from_string(template_content)
-    prompt = template.render(
-        sources=sources,
-        daily_summary=plan.daily_summary,
-        top_stories=plan.top_stories,
-        structure=plan.structure,
-    )
+    # The template inputs: both the sources and the plan
+    prompt_inputs = {
+        "sources": sources,
+        "daily_summary": plan.daily_summary,
+        "top_stories": plan.top_stories,
+        "structure": plan.structure,
+    }
 
-    # Make LLM call for article generation
-    if article_model_type:
-        # Use OpenRouter with specified model type
-        openrouter_model = create_openrouter_model(article_model_type)
-        agent = Agent(
-            model=openrouter_model,
-            output_type=LLMArticleV2,
-            system_prompt=prompt,
-            retries=3,
-        )
-        current_model = get_model_display_name(article_model_type)
-    # Use the local Ollama model if no model type is provided
-    else:
-        # Initialize the local Ollama model
-        if not ollama_host:
-            raise ValueError("ollama_host parameter is required to use local models. Please provide it (e.g., 'http://localhost:11434')")
-        
-        full_url = f"{ollama_host}/v1"
-        ollama_model = OpenAIChatModel(
-            model_name=model_name,
-            provider=OpenAIProvider(base_url=full_url),
+    # Render the article generation Jinja template (compiled once per run)
+    article_prompt = get_prompt("article/article_prompt_v2.jinja")
+    prompt = article_prompt.render(**prompt_inputs)
+
+    # The same sources and plan with the same model and prompt give the cached article
+    current_model = get_article_model_name(article_model_type)
+    key = cache_key(current_model, article_prompt.version, LLMArticleV2, prompt_inputs)
+    llm_article = cache.get(key, LLMArticleV2) if cache is not None else None
+    if llm_article is None:
+        # Make LLM call for article generation
+        agent = create_article_agent(
+            LLMArticleV2, prompt, article_model_type, ollama_host
         )
-        agent = Agent(
-            model=ollama_model,
-            output_type=LLMArticleV2,
-            system_prompt=prompt,
-            retries=3,
-        )
-        current_model = model_name
 
-    # Run the agent and get the result with retry logic
-    result = call_llm_with_retry(agent.run_sync, prompt)
-    llm_article = result.output
+        # Run the agent and get the result with retry logic
+        result = call_llm_with_retry(agent.run_sync, prompt)
+        llm_article = result.output
+        if cache is not None:
+            cache.put(key, current_model, article_prompt.version, llm_article)
+    else:
+        print("Using cached article")
 
     print(f"Generated article with title: {llm_article.title}")
     print(f"Article summary: {llm_article.summary}")
 
     # Create a full Article object from the LLMArticleV2 and additional metadata
     article = Article.from_llm_article_v2(
-        llm_article, model=current_model, prompt=prompt
+        llm_article,
+        model=current_model,
+        prompt_version=article_prompt.version,
+        prompt_inputs=prompt_inputs,
     )
 
     # Save the article to a markdown file with enhanced citations
@@ -1,79 +1,152 @@
 """
-Retry mechanism for LLM calls with exponential backoff.
+Retry mechanism for LLM calls with adaptive backoff.
 
-This module provides retry functionality for OpenRouter LLM calls to handle rate limiting
-with exponential backoff delays of 3s, 6s, 9s, and 12s.
+This module provides retry functionality for OpenRouter and Ollama LLM calls. Rate
+limits (429), timeouts, connection errors and 5xx responses are retried with jittered
+exponential backoff that honours the provider's Retry-After, tracked by a shared
+AdaptiveRateController (see llm/rate_controller.py) that also adapts concurrency and
+stops calling a provider that keeps failing.
 
 Using the call_llm_with_retry function:
    ```python
    from main.llm.call_llm import call_llm_with_retry
-   
+
    # Instead of: result = agent.run_sync(prompt)
    result = call_llm_with_retry(agent.run_sync, prompt)
    llm_output = result.output
    ```
 
-The retry mechanism automatically handles RateLimitError exceptions and retries with
-the specified backoff delays. Other exceptions are raised immediately without retry.
+Async callers use acall_llm_with_retry the same way, and pass their controller so it
+also limits how many calls run at the same time:
+   ```python
+   result = await acall_llm_with_retry(agent.run, prompt, controller=controller)
+   ```
+
+Other exceptions (bad requests, invalid output) are raised immediately without retry.
 """
 
 import time
-from typing import Callable, TypeVar
+from typing import Awaitable, Callable, TypeVar
 import logging
-from openai import RateLimitError
+import asyncio
+from llm.rate_controller import AdaptiveRateController, classify_error
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
+# Used for the sync calls and async calls without a controller of their own
+default_controller = AdaptiveRateController()
+
+
+def _handle_error(
+    controller: AdaptiveRateController, error: Exception, attempt: int, max_retries: int
+) -> float:
+    """
+    Record a failed attempt and get how long to wait before the next one.
+    Raises the error if it isn't retryable or the retries are used up.
+    """
+    retry = classify_error(error)
+    if not retry.retryable:
+        # Don't retry for errors that won't go away
+        logger.error(f"Non-retryable error in LLM call: {error}")
+        raise error
+
+    delay = controller.record_failure(retry, attempt)
+    if attempt == max_retries:
+        logger.error(f"Max retries ({max_retries}) exceeded for LLM call")
+        raise error
+
+    kind = "Rate limit error" if retry.rate_limited else "Retryable error"
+    logger.warning(
+        f"{kind} (attempt {attempt + 1}/{max_retries + 1}): {error}. "
+        f"Retrying in {delay:.1f} seconds..."
+    )
+    return delay
+
 
 def call_llm_with_retry(
     agent_run_func: Callable[..., T],
     *args,
     max_retries: int = 4,
-    backoff_delays: list[float] = [3.0, 6.0, 9.0, 12.0],
+    controller: AdaptiveRateController | None = None,
     **kwargs
 ) -> T:
     """
-    Call an LLM agent with retry logic and exponential backoff.
-    
+    Call an LLM agent with retry logic and adaptive backoff.
+
     Args:
-        agent_run_func: The agent.run_sync or agent.run function to call
+        agent_run_func: The agent.run_sync function to call
         *args: Arguments to pass to the agent run function
         max_retries: Maximum number of retry attempts (default: 4)
-        backoff_delays: List of delays in seconds for each retry attempt (default: [3, 6, 9, 12])
+        controller: Shared controller tracking the provider (default: the module's)
         **kwargs: Keyword arguments to pass to the agent run function
-    
+
     Returns:
         The result of the agent run function
-    
+
     Raises:
-        RateLimitError: If max retries are exceeded
-        Other exceptions: Any non-rate-limit errors are raised immediately
+        CircuitOpenError: If the provider kept failing and the circuit is open
+        Retryable errors: If max retries are exceeded
+        Other exceptions: Any non-retryable errors are raised immediately
     """
-    last_exception = None
-    
+    controller = controller or default_controller
+
     for attempt in range(max_retries + 1):
+        controller.check_circuit()
+        # Wait out a pause started by a rate limit
+        time.sleep(controller.pause_remaining())
+
+        start_time = time.monotonic()
         try:
-            return agent_run_func(*args, **kwargs)
-        except RateLimitError as e:
-            last_exception = e
-            if attempt == max_retries:
-                logger.error(f"Max retries ({max_retries}) exceeded for LLM call")
-                raise e
-            
-            delay = backoff_delays[min(attempt, len(backoff_delays) - 1)]
-            logger.warning(
-                f"Rate limit error (attempt {attempt + 1}/{max_retries + 1}). "
-                f"Retrying in {delay} seconds..."
-            )
-            time.sleep(delay)
+            result = agent_run_func(*args, **kwargs)
         except Exception as e:
-            # Don't retry for non-rate-limit errors
-            logger.error(f"Non-retryable error in LLM call: {e}")
-            raise e
-    
-    # This should never be reached, but just in case
-    raise last_exception
+            time.sleep(_handle_error(controller, e, attempt, max_retries))
+        else:
+            controller.record_success(time.monotonic() - start_time)
+            return result
 
+
+async def acall_llm_with_retry(
+    agent_run_func: Callable[..., Awaitable[T]],
+    *args,
+    max_retries: int = 4,
+    controller: AdaptiveRateController | None = None,
+    kind: str = "default",
+    **kwargs
+) -> T:
+    """
+    Async version of call_llm_with_retry, waiting without blocking the event loop.
+    Every attempt waits for a free slot of the controller.
+
+    Args:
+        agent_run_func: The agent.run function to call
+        *args: Arguments to pass to the agent run function
+        max_retries: Maximum number of retry attempts (default: 4)
+        controller: Shared controller limiting the provider's calls (default: the module's)
+        kind: Kind of call, latency is only compared between calls of the same kind
+        **kwargs: Keyword arguments to pass to the agent run function
+
+    Returns:
+        The result of the agent run function
+
+    Raises:
+        CircuitOpenError: If the provider kept failing and the circuit is open
+        Retryable errors: If max retries are exceeded
+        Other exceptions: Any non-retryable errors are raised immediately
+    """
+    controller = controller or default_controller
+
+    for attempt in range(max_retries + 1):
+        async with controller.slot():
+            start_time = time.monotonic()
+            try:
+                result = await agent_run_func(*args, **kwargs)
+            except Exception as e:
+                delay = _handle_error(controller, e, attempt, max_retries)
+            else:
+                controller.record_success(time.monotonic() - start_time, kind)
+                return result
+        # Back off without holding the slot
+        await asyncio.sleep(delay)
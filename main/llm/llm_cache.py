@@ -0,0 +1,167 @@
+"""
+Persistent cache of LLM outputs, in the llm_cache table.
+
+Entries are content addressed: the key is a hash of the model, the prompt template
+version, the output type and the template inputs. A rerun with the same inputs gets
+the same output back without calling the model, and any change to the prompt or the
+inputs is a new key. Entries expire after a TTL, and the oldest ones are evicted when
+there are too many.
+
+Usage:
+   ```python
+   cache = LLMCache(db)
+   key = cache_key(model_name, prompt.version, LLMRank, prompt_inputs)
+   llm_rank = cache.get(key, LLMRank)
+   if llm_rank is None:
+       llm_rank = (await agent.run(prompt)).output
+       cache.put(key, model_name, prompt.version, llm_rank)
+   ```
+"""
+
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Type, TypeVar
+from pydantic import BaseModel
+from sqlmodel import Session
+from db.database import NewsDatabase
+from db.async_writer import AsyncDatabaseWriter, DatabaseWriterError
+from pydantic_models.llm_cache_model import LLMCacheEntry
+
+# How long a cached output is reused
+CACHE_TTL = timedelta(days=30)
+# The oldest entries are evicted beyond this many
+MAX_CACHE_ENTRIES = 50_000
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def cache_key(
+    model: str, prompt_version: str, output_type: Type[BaseModel], inputs: Any
+) -> str:
+    """
+    Hash everything that goes into an LLM call.
+
+    Args:
+        model: Model name
+        prompt_version: Version of the prompt template (see llm.prompt_registry)
+        output_type: Model the output is parsed into
+        inputs: The template inputs and user message, anything JSON-serializable
+
+    Returns:
+        Hex SHA-256 of the call
+    """
+    payload = json.dumps(
+        {
+            "model": model,
+            "prompt_version": prompt_version,
+            "output_type": output_type.__name__,
+            "inputs": inputs,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _utc_now() -> datetime:
+    """Naive UTC now, matching the stored datetimes"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LLMCache:
+    """
+    Cache of LLM outputs stored in the database.
+    Expired and surplus entries are evicted when the cache is opened.
+    """
+
+    def __init__(
+        self,
+        db: NewsDatabase,
+        ttl: timedelta = CACHE_TTL,
+        max_entries: int = MAX_CACHE_ENTRIES,
+        writer: AsyncDatabaseWriter | None = None,
+    ):
+        """
+        Args:
+            db: Database holding the llm_cache table
+            ttl: How long a cached output is reused
+            max_entries: Entries kept, the oldest beyond this are evicted
+            writer: When given, async puts are queued on it instead of written directly
+        """
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.writer = writer
+        self.hits = 0
+        self.misses = 0
+        self.evict()
+
+    def get(self, key: str, output_type: Type[M]) -> M | None:
+        """Get a cached output that hasn't expired yet, or None"""
+        with Session(self.db.engine) as session:
+            entry = session.get(LLMCacheEntry, key)
+        if entry is None or entry.created_at < _utc_now() - self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return output_type.model_validate_json(entry.output)
+
+    def put(self, key: str, model: str, prompt_version: str, output: BaseModel) -> None:
+        """Store an output, replacing any earlier entry with the same key"""
+        self.db.save_objects([self._entry(key, model, prompt_version, output)])
+
+    async def aget(self, key: str, output_type: Type[M]) -> M | None:
+        """Async get, reading on a worker thread"""
+        return await asyncio.to_thread(self.get, key, output_type)
+
+    async def aput(
+        self, key: str, model: str, prompt_version: str, output: BaseModel
+    ) -> None:
+        """Async put, queued on the writer if there is one"""
+        entry = self._entry(key, model, prompt_version, output)
+        if self.writer is not None:
+            try:
+                await self.writer.put(entry)
+            except DatabaseWriterError:
+                # Caching is best effort, the output just won't be reused
+                pass
+        else:
+            await asyncio.to_thread(self.db.save_objects, [entry])
+
+    def _entry(
+        self, key: str, model: str, prompt_version: str, output: BaseModel
+    ) -> LLMCacheEntry:
+        """Build the row for an output"""
+        return LLMCacheEntry(
+            key=key,
+            model=model,
+            prompt_version=prompt_version,
+            output=output.model_dump_json(),
+        )
+
+    def evict(self) -> int:
+        """
+        Delete the expired entries, then the oldest ones beyond max_entries.
+
+        Returns:
+            The number of entries deleted
+        """
+        cutoff = (_utc_now() - self.ttl).isoformat(" ")
+        with self.db.engine.begin() as conn:
+            expired = conn.exec_driver_sql(
+                "DELETE FROM llm_cache WHERE created_at < ?", (cutoff,)
+            ).rowcount
+            surplus = conn.exec_driver_sql(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY created_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            ).rowcount
+        if expired or surplus:
+            print(f"Evicted {expired + surplus} LLM cache entries")
+        return expired + surplus
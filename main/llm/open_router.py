@@ -1,23 +1,28 @@
 import yaml
 import os
+import httpx
+from functools import lru_cache
 from pathlib import Path
 from pydantic_ai.models.openai import OpenAIChatModel
 from pydantic_ai.providers.openai import OpenAIProvider
+from openai import AsyncOpenAI
 from typing import Literal
 
 # Define model types
 ModelType = Literal["free", "fast", "smart"]
 
 
+@lru_cache(maxsize=None)
 def load_openrouter_settings() -> dict:
-    """Load OpenRouter settings from YAML file."""
+    """Load OpenRouter settings from YAML file (read once per run)."""
     settings_path = Path(__file__).parent / "open_router_settings.yaml"
     with open(settings_path, "r") as f:
         return yaml.safe_load(f)
 
 
+@lru_cache(maxsize=None)
 def load_api_keys() -> dict:
-    """Load API keys from the keys YAML file."""
+    """Load API keys from the keys YAML file (read once per run)."""
     keys_path = Path(__file__).parent.parent.parent / "keys" / "key.yaml"
     with open(keys_path, "r") as f:
         return yaml.safe_load(f)
@@ -36,8 +41,48 @@ def get_openrouter_model_name(model_type: ModelType) -> str:
     return model_mapping[model_type]
 
 
-def create_openrouter_model(model_type: ModelType) -> OpenAIChatModel:
-    """Create an OpenRouter model instance for the specified model type."""
+def create_openai_provider(
+    base_url: str,
+    api_key: str | None = None,
+    http_client: httpx.AsyncClient | None = None,
+    max_retries: int | None = None,
+) -> OpenAIProvider:
+    """
+    Create a provider for an OpenAI-compatible API (OpenRouter or Ollama).
+
+    Args:
+        base_url: API base URL
+        api_key: API key, if the API needs one
+        http_client: HTTP client to send the requests with, so several calls can share
+            its connection pool (pydantic_ai's shared client is used if not given)
+        max_retries: Retries done by the openai client itself (its default if not given).
+            Set to 0 to leave every retry to call_llm_with_retry.
+    """
+    if max_retries is None:
+        return OpenAIProvider(base_url=base_url, api_key=api_key, http_client=http_client)
+
+    openai_client = AsyncOpenAI(
+        base_url=base_url,
+        api_key=api_key or "api-key-not-set",
+        http_client=http_client,
+        max_retries=max_retries,
+    )
+    return OpenAIProvider(openai_client=openai_client)
+
+
+def create_openrouter_model(
+    model_type: ModelType,
+    http_client: httpx.AsyncClient | None = None,
+    max_retries: int | None = None,
+) -> OpenAIChatModel:
+    """
+    Create an OpenRouter model instance for the specified model type.
+
+    Args:
+        model_type: Which of the configured models to use
+        http_client: HTTP client to send the requests with (see create_openai_provider)
+        max_retries: Retries done by the openai client itself (see create_openai_provider)
+    """
     settings = load_openrouter_settings()
     keys = load_api_keys()
 
@@ -45,12 +90,23 @@ def create_openrouter_model(model_type: ModelType) -> OpenAIChatModel:
 
     return OpenAIChatModel(
         model_name=model_name,
-        provider=OpenAIProvider(
-            base_url=settings["OPENROUTER_BASE_URL"], api_key=keys["openrouter_key"]
+        provider=create_openai_provider(
+            settings["OPENROUTER_BASE_URL"],
+            keys["openrouter_key"],
+            http_client,
+            max_retries,
         ),
     )
 
 
+def get_max_concurrency(model_type: ModelType | None) -> int:
+    """Get how many LLM calls can run at the same time (no model type means the local Ollama host)."""
+    settings = load_openrouter_settings()
+    if model_type:
+        return settings["OPENROUTER_MAX_CONCURRENCY"]
+    return settings["OLLAMA_MAX_CONCURRENCY"]
+
+
 def get_model_display_name(model_type: ModelType) -> str:
     """Get a display name for the model type and actual model."""
     model_name = get_openrouter_model_name(model_type)
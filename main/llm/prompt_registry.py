@@ -0,0 +1,90 @@
+"""
+Registry of the jinja prompt templates.
+
+Each template file is read and compiled once per process, and identified by a hash of
+its content, so a changed template automatically gets a new version. Ranks and articles
+store that version and their template inputs instead of the full rendered prompt, and
+the template itself is stored once in the prompt_template table.
+
+Usage:
+   ```python
+   from llm.prompt_registry import get_prompt
+
+   rank_prompt = get_prompt("rank/rank_prompt_v3.jinja")
+   prompt = rank_prompt.render(tweet=tweet_info, **date_info)
+   rank.prompt_version = rank_prompt.version
+   ```
+"""
+
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, List
+import jinja2
+from pydantic_models.prompt_template_model import PromptTemplate
+
+# Template names are relative to main/llm
+PROMPT_DIR = Path(__file__).parent
+
+_jinja_env = jinja2.Environment()
+
+# Templates compiled so far in this process, by name
+_prompts: dict[str, "CompiledPrompt"] = {}
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledPrompt:
+    """A template compiled once, with the content hash identifying its version"""
+
+    name: str
+    version: str
+    source: str
+    template: jinja2.Template
+
+    def render(self, **inputs: Any) -> str:
+        """Render the prompt with the given inputs"""
+        return self.template.render(**inputs)
+
+    def to_record(self) -> PromptTemplate:
+        """The prompt_template row for this version"""
+        return PromptTemplate(version=self.version, name=self.name, source=self.source)
+
+
+def prompt_version(source: str) -> str:
+    """Version of a template: the start of the SHA-256 of its source"""
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+def get_prompt(name: str) -> CompiledPrompt:
+    """
+    Get a compiled template, reading and compiling it on first use only.
+
+    Args:
+        name: Template file relative to main/llm, e.g. "rank/rank_prompt_v3.jinja"
+
+    Returns:
+        The CompiledPrompt
+    """
+    if name not in _prompts:
+        source = (PROMPT_DIR / name).read_text(encoding="utf-8")
+        _prompts[name] = CompiledPrompt(
+            name=name,
+            version=prompt_version(source),
+            source=source,
+            template=_jinja_env.from_string(source),
+        )
+    return _prompts[name]
+
+
+def loaded_prompt_records() -> List[PromptTemplate]:
+    """The prompt_template rows of every template used so far in this process"""
+    return [prompt.to_record() for prompt in _prompts.values()]
+
+
+def render_stored_prompt(template: PromptTemplate, prompt_inputs: dict) -> str:
+    """
+    Rebuild the rendered template of a stored rank or article from its inputs.
+    Inputs the template doesn't use (like the tweet, which ranking sends as the user
+    message) are only kept in prompt_inputs.
+    """
+    return _jinja_env.from_string(template.source).render(**prompt_inputs)
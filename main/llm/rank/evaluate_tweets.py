@@ -1,17 +1,27 @@
+import asyncio
 import os
+import httpx
 from pydantic_ai import Agent
 from pydantic_ai.models.openai import OpenAIChatModel
-from pydantic_ai.providers.openai import OpenAIProvider
 import logfire
 from pydantic_models.tweet_model import Tweet
 from pydantic_models.rank_model import Rank
-from pydantic_models.llm_rank_model import LLMRank
-import jinja2
-import pathlib
+from pydantic_models.llm_rank_model import LLMRank, LLMRankBatch
+from pydantic_models.link_content_model import LinkContent
+from links.unfurl_links import format_link_summaries
 from datetime import datetime, timedelta
-from llm.open_router import create_openrouter_model, get_model_display_name, ModelType
-from llm.call_llm import call_llm_with_retry
-from typing import Optional
+from llm.open_router import (
+    create_openai_provider,
+    create_openrouter_model,
+    get_max_concurrency,
+    get_model_display_name,
+    ModelType,
+)
+from llm.call_llm import acall_llm_with_retry
+from llm.rate_controller import AdaptiveRateController
+from llm.prompt_registry import get_prompt
+from llm.llm_cache import LLMCache, cache_key
+from typing import AsyncIterator, Awaitable, Callable, Optional
 
 # # Send LLM logs to Logfire
 # logfire.configure()
@@ -45,65 +55,427 @@ def get_date_info() -> dict[str, str]:
     }
 
 
-def format_tweet_info(tweet: Tweet) -> str:
+def format_tweet_info(
+    tweet: Tweet,
+    linked_tweet: Optional[Tweet] = None,
+    link_contents: Optional[list[LinkContent]] = None,
+) -> str:
     """
     Format important information from a tweet into a readable string.
+    Includes the quoted or replied-to tweet and the linked pages' summaries when given.
     """
     tweet_info = f"Tweet text: {tweet.text}\n"
     tweet_info += f"Username: {tweet.username}\n"
     tweet_info += f"Created at: {tweet.created_at}\n"
+    if linked_tweet is not None:
+        label = "Quoted tweet" if tweet.tweet_type == "quote" else "Replying to"
+        tweet_info += f"{label} from {linked_tweet.username}: {linked_tweet.text}\n"
+    if link_contents:
+        tweet_info += f"Linked pages:\n{format_link_summaries(link_contents)}\n"
     # tweet_info += f"Retweet count: {tweet.retweet_count}\n"
     # tweet_info += f"Reply count: {tweet.reply_count}\n"
     # tweet_info += f"Like count: {tweet.like_count}\n"
     return tweet_info
 
 
-def rank_tweet(tweet: Tweet, rank_model_type: Optional[ModelType] = None, ollama_host: Optional[str] = None) -> Rank:
-    # Get formatted tweet information
-    tweet_info = format_tweet_info(tweet)
+# Connections kept open to the model host, shared by all the calls of a run
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+HTTP_TIMEOUT = httpx.Timeout(600, connect=10)
 
-    # Get date information for the template
-    date_info = get_date_info()
+# Batch ranking packs tweets into one call until their formatted text reaches about
+# this many tokens, or this many tweets (the answer grows with every tweet too)
+MAX_BATCH_TOKENS = 6000
+MAX_BATCH_TWEETS = 20
+# Rough token estimate for English text
+CHARS_PER_TOKEN = 4
 
-    # Pull in the jinja prompt
-    template_path = pathlib.Path(__file__).parent / "rank_prompt_v3.jinja"
-    with open(template_path, "r") as f:
-        template_content = f.read()
 
-    # Render the template with the tweet text and date information
-    jinja_env = jinja2.Environment()
-    template = jinja_env.from_string(template_content)
-    prompt = template.render(tweet=tweet_info, **date_info)
+def estimate_tokens(text: str) -> int:
+    """Rough number of tokens in a text, good enough to size batches"""
+    return len(text) // CHARS_PER_TOKEN + 1
 
-    if rank_model_type:
-        # Use OpenRouter with specified model type
-        openrouter_model = create_openrouter_model(rank_model_type)
-        agent = Agent(
-            model=openrouter_model, output_type=LLMRank, system_prompt=prompt, retries=3
+
+def batch_by_tokens(
+    tweet_infos: list[str],
+    max_tokens: int = MAX_BATCH_TOKENS,
+    max_tweets: int = MAX_BATCH_TWEETS,
+) -> list[list[int]]:
+    """
+    Group formatted tweets into batches, in order, without going over either limit.
+    A tweet bigger than max_tokens gets a batch of its own.
+
+    Returns:
+        The indexes of the tweets in each batch
+    """
+    batches = []
+    batch, batch_tokens = [], 0
+    for i, tweet_info in enumerate(tweet_infos):
+        tokens = estimate_tokens(tweet_info)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_tweets):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def format_tweet_message(tweet_info: str) -> str:
+    """The user message for ranking one tweet"""
+    return f"# Tweet info\n{tweet_info}"
+
+
+def format_batch_message(items: list[dict[str, str]]) -> str:
+    """The user message for ranking a batch of tweets, each under its tweet ID"""
+    return "# Tweets\n" + "\n".join(
+        f"## Tweet ID: {item['tweet_id']}\n{item['tweet']}" for item in items
+    )
+
+
+class RankingEngine:
+    """
+    Ranks tweets with one model, HTTP client and Agent built once per run.
+    The instructions and date context are the system prompt, identical for every call
+    of the run, and only the tweet is sent as the user message.
+
+    Calls run concurrently, at most max_concurrency at a time (by default the limit
+    configured for OpenRouter or for the local Ollama host), adapting to rate limits
+    and latency below that.
+    The engine's HTTP client is tied to the event loop it's first used on, so create
+    and use the engine within one asyncio.run.
+
+    Usage:
+        async with RankingEngine(rank_model_type, ollama_host) as engine:
+            async for tweet, rank in engine.arank_all(tweets):
+                ...
+    """
+
+    def __init__(
+        self,
+        rank_model_type: Optional[ModelType] = None,
+        ollama_host: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        cache: Optional[LLMCache] = None,
+    ):
+        """
+        Args:
+            rank_model_type: OpenRouter model type to use, or None for the local Ollama model
+            ollama_host: Ollama host URL, required when no model type is given
+            max_concurrency: Most LLM calls running at the same time (defaults to the
+                configured limit for the provider)
+            cache: When given, tweets already ranked with the same model, prompt and
+                inputs get the cached rank instead of a new call
+        """
+        # One connection pool for every call of the run
+        self.http_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+        if rank_model_type:
+            # Use OpenRouter with specified model type
+            model = create_openrouter_model(rank_model_type, self.http_client, max_retries=0)
+            self.model_name = get_model_display_name(rank_model_type)
+        else:
+            # Initialize the local Ollama model
+            if not ollama_host:
+                raise ValueError("ollama_host parameter is required to use local models. Please provide it (e.g., 'http://localhost:11434')")
+
+            full_url = f"{ollama_host}/v1"
+            model = OpenAIChatModel(
+                model_name=model_name,
+                provider=create_openai_provider(
+                    full_url, http_client=self.http_client, max_retries=0
+                ),
+            )
+            self.model_name = model_name
+
+        # The instructions and dates are rendered once, so every call of the run starts
+        # with the same system prompt and the provider can cache it
+        self.date_info = get_date_info()
+        self.rank_prompt = get_prompt("rank/rank_prompt_v4.jinja")
+        self.batch_prompt = get_prompt("rank/rank_batch_prompt_v2.jinja")
+        self.agent = Agent(
+            model=model,
+            output_type=LLMRank,
+            system_prompt=self.rank_prompt.render(**self.date_info),
+            retries=3,
         )
-        current_model = get_model_display_name(rank_model_type)
-    else:
-        # Initialize the local Ollama model
-        if not ollama_host:
-            raise ValueError("ollama_host parameter is required to use local models. Please provide it (e.g., 'http://localhost:11434')")
-        
-        full_url = f"{ollama_host}/v1"
-        ollama_model = OpenAIChatModel(
-            model_name=model_name,
-            provider=OpenAIProvider(base_url=full_url),
+        self.batch_agent = Agent(
+            model=model,
+            output_type=LLMRankBatch,
+            system_prompt=self.batch_prompt.render(**self.date_info),
+            retries=3,
         )
-        agent = Agent(
-            model=ollama_model, output_type=LLMRank, system_prompt=prompt, retries=3
+
+        # Concurrency adapts to rate limits and latency, up to the configured limit
+        self.max_concurrency = max_concurrency or get_max_concurrency(rank_model_type)
+        self.rate_controller = AdaptiveRateController(max_concurrency=self.max_concurrency)
+        self.cache = cache
+
+    async def __aenter__(self) -> "RankingEngine":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the HTTP client's connections"""
+        await self.http_client.aclose()
+
+    async def _run(self, agent: Agent, prompt: str, kind: str):
+        """Run an agent, waiting for a free slot of the rate controller first"""
+        return await acall_llm_with_retry(
+            agent.run, prompt, controller=self.rate_controller, kind=kind
         )
-        current_model = model_name
 
-    # Get the LLM output as LLMRank with retry logic
-    result = call_llm_with_retry(agent.run_sync, prompt)
-    llm_rank = result.output
+    def _cache_key(self, prompt_version: str, tweet_info: str) -> str:
+        """Cache key of one tweet's rank (the dates are part of the system prompt)"""
+        inputs = {"tweet": tweet_info, **self.date_info}
+        return cache_key(self.model_name, prompt_version, LLMRank, inputs)
 
-    # Convert LLMRank to a full Rank with additional metadata
-    rank = Rank.from_llm_rank(
-        llm_rank=llm_rank, tweet_id=tweet.tweet_id, model=current_model, prompt=prompt
-    )
+    async def _cached_rank(self, prompt_version: str, tweet_info: str) -> LLMRank | None:
+        """The cached rank of a tweet, if there is a cache and it has one"""
+        if self.cache is None:
+            return None
+        return await self.cache.aget(self._cache_key(prompt_version, tweet_info), LLMRank)
 
-    return rank
+    async def _cache_rank(self, prompt_version: str, tweet_info: str, llm_rank: LLMRank):
+        """Cache a tweet's rank, if there is a cache"""
+        if self.cache is not None:
+            await self.cache.aput(
+                self._cache_key(prompt_version, tweet_info),
+                self.model_name,
+                prompt_version,
+                llm_rank,
+            )
+
+    async def arank(
+        self,
+        tweet: Tweet,
+        linked_tweet: Optional[Tweet] = None,
+        link_contents: Optional[list[LinkContent]] = None,
+    ) -> Rank:
+        """
+        Rank a tweet.
+
+        Args:
+            tweet: Tweet to rank
+            linked_tweet: The quoted or replied-to tweet, given to the model as context
+            link_contents: The pages the tweet links to, given to the model as context
+
+        Returns:
+            The Rank (not saved)
+        """
+        # Get formatted tweet information (with the quoted or replied-to tweet and
+        # the linked pages as context)
+        tweet_info = format_tweet_info(tweet, linked_tweet, link_contents)
+
+        llm_rank = await self._cached_rank(self.rank_prompt.version, tweet_info)
+        if llm_rank is None:
+            # Only the tweet is sent as the user message, after the shared system prompt
+            result = await self._run(
+                self.agent, format_tweet_message(tweet_info), "rank"
+            )
+            llm_rank = result.output
+            await self._cache_rank(self.rank_prompt.version, tweet_info, llm_rank)
+
+        # Convert LLMRank to a full Rank with additional metadata
+        # The rank only stores the template version and inputs, not the full prompt
+        return Rank.from_llm_rank(
+            llm_rank=llm_rank,
+            tweet_id=tweet.tweet_id,
+            model=self.model_name,
+            prompt_version=self.rank_prompt.version,
+            prompt_inputs={"tweet": tweet_info, **self.date_info},
+        )
+
+    async def arank_all(
+        self,
+        tweets: list[Tweet],
+        linked_tweets: Optional[dict[str, Tweet]] = None,
+        link_summaries: Optional[dict[str, list[LinkContent]]] = None,
+        batch: bool = False,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_batch_tweets: int = MAX_BATCH_TWEETS,
+    ) -> AsyncIterator[tuple[Tweet, Rank]]:
+        """
+        Rank tweets concurrently, yielding each rank as soon as it's done.
+
+        In batch mode several tweets are ranked per call, so the instructions are sent
+        once per batch instead of once per tweet. Tweets the model skipped or ranked
+        badly are ranked again on their own.
+
+        Args:
+            tweets: Tweets to rank (with unique tweet IDs)
+            linked_tweets: Quoted and replied-to tweets by tweet ID, given as context
+            link_summaries: Linked pages by the ID of the tweet linking them, given as context
+            batch: Rank several tweets per call
+            max_batch_tokens: Estimated tokens of tweet text per batch
+            max_batch_tweets: Tweets per batch
+
+        Yields:
+            Each tweet with its Rank (not saved), in the order they finish
+        """
+        linked_tweets = linked_tweets or {}
+        link_summaries = link_summaries or {}
+
+        async def rank_one(tweet: Tweet) -> list[tuple[Tweet, Rank]]:
+            rank = await self.arank(
+                tweet,
+                linked_tweets.get(tweet.linked_tweet_id),
+                link_summaries.get(tweet.tweet_id),
+            )
+            return [(tweet, rank)]
+
+        if batch:
+            tweet_infos = [
+                format_tweet_info(
+                    tweet,
+                    linked_tweets.get(tweet.linked_tweet_id),
+                    link_summaries.get(tweet.tweet_id),
+                )
+                for tweet in tweets
+            ]
+            jobs = [
+                self._arank_batch(
+                    [tweets[i] for i in indexes],
+                    [tweet_infos[i] for i in indexes],
+                    rank_one,
+                )
+                for indexes in batch_by_tokens(
+                    tweet_infos, max_batch_tokens, max_batch_tweets
+                )
+            ]
+        else:
+            jobs = [rank_one(tweet) for tweet in tweets]
+
+        tasks = [asyncio.create_task(job) for job in jobs]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for tweet, rank in await finished:
+                    yield tweet, rank
+        finally:
+            # Stop the remaining calls if the caller stops early or a call failed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _arank_batch(
+        self,
+        tweets: list[Tweet],
+        tweet_infos: list[str],
+        rank_one: Callable[[Tweet], Awaitable[list[tuple[Tweet, Rank]]]],
+    ) -> list[tuple[Tweet, Rank]]:
+        """
+        Rank one batch of formatted tweets in a single call (or none, if every tweet's
+        rank is cached).
+        Unknown or repeated IDs and scores outside 1-10 are ignored, and the tweets
+        without a valid rank are ranked on their own with rank_one.
+
+        Returns:
+            Each tweet of the batch with its Rank
+        """
+        items = [
+            {"tweet_id": tweet.tweet_id, "tweet": tweet_info}
+            for tweet, tweet_info in zip(tweets, tweet_infos)
+        ]
+        llm_ranks: dict[str, LLMRank] = {}
+        # Tweets ranked before with the same model and prompt are left out of the call,
+        # whether they were ranked in a batch or on their own (as a batch's fallback)
+        single_ids = set()
+        for item in items:
+            cached = await self._cached_rank(self.batch_prompt.version, item["tweet"])
+            if cached is None:
+                cached = await self._cached_rank(self.rank_prompt.version, item["tweet"])
+                if cached is not None:
+                    single_ids.add(item["tweet_id"])
+            if cached is not None:
+                llm_ranks[item["tweet_id"]] = cached
+        uncached = [item for item in items if item["tweet_id"] not in llm_ranks]
+
+        if uncached:
+            try:
+                result = await self._run(
+                    self.batch_agent, format_batch_message(uncached), "rank_batch"
+                )
+            except Exception as e:
+                print(f"Batch of {len(uncached)} tweet(s) failed, ranking them one by one: {e}")
+            else:
+                expected_ids = {item["tweet_id"] for item in uncached}
+                new_ranks: dict[str, LLMRank] = {}
+                repeated_ids = set()
+                for llm_rank in result.output.ranks:
+                    if llm_rank.tweet_id not in expected_ids or not 1 <= llm_rank.score <= 10:
+                        continue
+                    if llm_rank.tweet_id in new_ranks:
+                        repeated_ids.add(llm_rank.tweet_id)
+                    new_ranks[llm_rank.tweet_id] = LLMRank(
+                        reason=llm_rank.reason, score=llm_rank.score
+                    )
+                # A tweet ranked twice is ambiguous, rank it again on its own
+                for tweet_id in repeated_ids:
+                    del new_ranks[tweet_id]
+
+                for item in uncached:
+                    if item["tweet_id"] in new_ranks:
+                        await self._cache_rank(
+                            self.batch_prompt.version,
+                            item["tweet"],
+                            new_ranks[item["tweet_id"]],
+                        )
+                llm_ranks.update(new_ranks)
+
+        ranked = []
+        missing = []
+        for tweet, item in zip(tweets, items):
+            llm_rank = llm_ranks.get(tweet.tweet_id)
+            if llm_rank is None:
+                missing.append(tweet)
+                continue
+            if tweet.tweet_id in single_ids:
+                # Cached from ranking the tweet on its own, keep that prompt's inputs
+                prompt_version = self.rank_prompt.version
+                prompt_inputs = {"tweet": item["tweet"], **self.date_info}
+            else:
+                # Each rank only stores its own part of the batch's inputs
+                prompt_version = self.batch_prompt.version
+                prompt_inputs = {"tweets": [item], **self.date_info}
+            rank = Rank.from_llm_rank(
+                llm_rank=llm_rank,
+                tweet_id=tweet.tweet_id,
+                model=self.model_name,
+                prompt_version=prompt_version,
+                prompt_inputs=prompt_inputs,
+            )
+            ranked.append((tweet, rank))
+
+        # Missing or invalid in the batch answer, rank them on their own
+        if missing:
+            print(f"Ranking {len(missing)} tweet(s) of the batch on their own")
+            for singles in await asyncio.gather(*(rank_one(tweet) for tweet in missing)):
+                ranked.extend(singles)
+        return ranked
+
+
+async def arank_tweet(
+    tweet: Tweet,
+    rank_model_type: Optional[ModelType] = None,
+    ollama_host: Optional[str] = None,
+    linked_tweet: Optional[Tweet] = None,
+    link_contents: Optional[list[LinkContent]] = None,
+) -> Rank:
+    """Rank a single tweet. Use a RankingEngine to rank several tweets."""
+    async with RankingEngine(rank_model_type, ollama_host) as engine:
+        return await engine.arank(tweet, linked_tweet, link_contents)
+
+
+def rank_tweet(
+    tweet: Tweet,
+    rank_model_type: Optional[ModelType] = None,
+    ollama_host: Optional[str] = None,
+    linked_tweet: Optional[Tweet] = None,
+    link_contents: Optional[list[LinkContent]] = None,
+) -> Rank:
+    """Synchronous entry point for arank_tweet."""
+    return asyncio.run(
+        arank_tweet(tweet, rank_model_type, ollama_host, linked_tweet, link_contents)
+    )
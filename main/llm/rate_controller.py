@@ -0,0 +1,237 @@
+"""
+Adaptive concurrency and backoff for LLM calls.
+
+One AdaptiveRateController is shared by every call to a provider. It lets calls run
+up to its current concurrency limit, and adjusts that limit from what it sees:
+- every success raises the limit a little (by about one per limit's worth of
+  successes), up to max_concurrency
+- a 429, or responses getting much slower than the fastest seen, halves it
+  (at most once per cooldown, since calls in flight fail together)
+
+Failed calls are retried with jittered exponential backoff, waiting at least as
+long as the provider's Retry-After. A 429 pauses every caller, not just the one
+that got it. After failure_threshold retryable failures in a row the circuit
+opens and calls fail fast for circuit_cooldown seconds, then one round of calls
+is let through to test the provider again.
+
+Usage:
+   ```python
+   controller = AdaptiveRateController(max_concurrency=8)
+   result = await acall_llm_with_retry(agent.run, prompt, controller=controller)
+   ```
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator
+import httpx
+from openai import APIConnectionError, APIStatusError
+from pydantic_ai.exceptions import ModelHTTPError
+from http_retry import RETRYABLE_STATUS_CODES, backoff_delay, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider that keeps failing"""
+
+
+@dataclass
+class RetryInfo:
+    """How a failed LLM call should be handled"""
+
+    retryable: bool
+    rate_limited: bool = False
+    # Seconds the provider asked to wait, if it did
+    retry_after: float | None = None
+
+
+def classify_error(error: BaseException) -> RetryInfo:
+    """
+    Decide if a failed LLM call is worth retrying.
+    pydantic_ai wraps the provider's HTTP errors in ModelHTTPError, so the original
+    error (with the response headers) is looked up in the exception's causes.
+    """
+    status_code = None
+    retry_after = None
+    connection_error = False
+
+    current: BaseException | None = error
+    while current is not None:
+        if isinstance(current, (ModelHTTPError, APIStatusError)):
+            status_code = current.status_code
+        if isinstance(current, APIStatusError):
+            retry_after = parse_retry_after(current.response.headers)
+        if isinstance(
+            current,
+            (APIConnectionError, httpx.TimeoutException, httpx.TransportError, TimeoutError),
+        ):
+            connection_error = True
+        current = current.__cause__
+
+    if status_code == 429:
+        return RetryInfo(retryable=True, rate_limited=True, retry_after=retry_after)
+    # Same statuses the Twitter client retries (see http_retry.py)
+    if status_code in RETRYABLE_STATUS_CODES:
+        return RetryInfo(retryable=True, retry_after=retry_after)
+    if status_code is None and connection_error:
+        return RetryInfo(retryable=True)
+    return RetryInfo(retryable=False)
+
+
+class AdaptiveRateController:
+    """Shared AIMD concurrency limit, backoff and circuit breaker for one provider"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        initial_concurrency: int | None = None,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        decrease_cooldown: float = 5.0,
+        latency_tolerance: float = 3.0,
+        failure_threshold: int = 5,
+        circuit_cooldown: float = 30.0,
+    ):
+        """
+        Args:
+            max_concurrency: Most calls running at the same time
+            min_concurrency: Fewest calls allowed at the same time
+            initial_concurrency: Starting limit (defaults to half of max_concurrency)
+            base_delay: Backoff of the first retry, doubled for every further retry
+            max_delay: Longest backoff
+            decrease_cooldown: Seconds after a decrease before the limit can drop again
+            latency_tolerance: Latency (averaged) this many times the fastest seen
+                counts as overload
+            failure_threshold: Retryable failures in a row that open the circuit
+            circuit_cooldown: Seconds the circuit stays open
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(initial_concurrency or max(min_concurrency, max_concurrency // 2))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.decrease_cooldown = decrease_cooldown
+        self.latency_tolerance = latency_tolerance
+        self.failure_threshold = failure_threshold
+        self.circuit_cooldown = circuit_cooldown
+
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self._paused_until = 0.0
+        self._circuit_open_until = 0.0
+        self._last_decrease = float("-inf")
+        # Average and fastest average latency per kind of call
+        self._latency: dict[str, tuple[float, float]] = {}
+        # Created for the running event loop on first use
+        self._condition: asyncio.Condition | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def concurrency(self) -> int:
+        """Calls currently allowed at the same time"""
+        return max(self.min_concurrency, int(self.limit))
+
+    def check_circuit(self) -> None:
+        """Raise CircuitOpenError while the circuit is open"""
+        remaining = self._circuit_open_until - time.monotonic()
+        if remaining > 0:
+            raise CircuitOpenError(
+                f"LLM provider failed {self.consecutive_failures} times in a row, "
+                f"not calling it for another {remaining:.0f}s"
+            )
+
+    def pause_remaining(self) -> float:
+        """Seconds left before calls can start again after a 429"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def backoff_delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Exponential backoff with jitter, so retries from many calls spread out.
+        The provider's Retry-After takes precedence (see http_retry.backoff_delay).
+        """
+        return backoff_delay(attempt, self.base_delay, self.max_delay, retry_after)
+
+    def _decrease(self, factor: float, reason: str) -> None:
+        """Multiplicative decrease, skipped if the limit just dropped"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_concurrency), self.limit * factor)
+        logger.warning(f"{reason}, lowering LLM concurrency to {self.concurrency}")
+
+    def record_success(self, latency: float, kind: str = "default") -> None:
+        """
+        Grow the limit after a successful call, unless responses are slowing down.
+        Latency is compared per kind of call, since e.g. a batch takes longer than a
+        single tweet anyway.
+        """
+        self.consecutive_failures = 0
+
+        # Exponentially weighted average latency, compared with the fastest seen
+        average, floor = self._latency.get(kind, (latency, latency))
+        average = 0.8 * average + 0.2 * latency
+        floor = min(floor, average)
+        self._latency[kind] = (average, floor)
+
+        if average > self.latency_tolerance * floor:
+            self._decrease(0.5, "LLM responses are slowing down")
+        else:
+            # Additive increase: about +1 per limit's worth of successes
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+    def record_failure(self, retry: RetryInfo, attempt: int) -> float:
+        """
+        Track a retryable failure and get how long to wait before retrying.
+        A 429 lowers the limit and pauses every caller for the backoff.
+        """
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self._circuit_open_until = time.monotonic() + self.circuit_cooldown
+            logger.error(
+                f"LLM provider failed {self.consecutive_failures} times in a row, "
+                f"opening the circuit for {self.circuit_cooldown:.0f}s"
+            )
+
+        delay = self.backoff_delay(attempt, retry.retry_after)
+        if retry.rate_limited:
+            self._decrease(0.5, "Rate limited")
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait for a free call slot (and for any pause to end), and hold it"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A controller can outlive an asyncio.run, give the new loop its own condition
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        condition = self._condition
+
+        async with condition:
+            while True:
+                self.check_circuit()
+                pause = self.pause_remaining()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < self.concurrency:
+                    break
+                else:
+                    await condition.wait()
+            self.in_flight += 1
+
+        try:
+            yield
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                condition.notify_all()
@@ -1,11 +1,23 @@
-from twitter.get_tweets import get_tweets
-from db.database import NewsDatabase
+from twitter.collect_tweets import collect_tweets, print_fetch_reports
+from twitter.get_tweets import parse_date_range, unique_tweets
+from twitter.fetch_strategy import FetchStrategy
+from twitter.twitter_client import TwitterClient, get_default_client
+from twitter.hydrate_tweets import hydrate_linked_tweets
+from links.unfurl_links import unfurl_links, get_link_summaries
+from twitter.page_archive import PageArchive
+from db.database import NewsDatabase, DEFAULT_DB_PATH
+from db.async_writer import AsyncDatabaseWriter, DatabaseWriterError
+from db.parquet_archive import archive_old_rows
 import argparse
+import asyncio
 from pydantic_models.tweet_model import Tweet
-from llm.rank.evaluate_tweets import rank_tweet
+from pydantic_models.link_content_model import LinkContent
+from llm.rank.evaluate_tweets import RankingEngine
 from pydantic_models.rank_model import Rank
 from pydantic_models.article_model import Article
 from llm.article.create_article import collect_tweets_for_article, create_article
+from llm.prompt_registry import loaded_prompt_records
+from llm.llm_cache import LLMCache
 from twitter.get_profiles import get_people_usernames, get_organization_usernames
 from datetime import datetime, timedelta
 import time
@@ -14,7 +26,7 @@ from typing import Optional
 import yaml
 import pathlib
 
-db_path = "main/db/news_data.db"
+db_path = DEFAULT_DB_PATH
 
 # Set the specific date to run for
 RUN_DAY = "2025-09-26"  # Format: YYYY-MM-DD
@@ -23,6 +35,18 @@ RUN_DAY = "2025-09-26"  # Format: YYYY-MM-DD
 
 GET_TEST_DATA = True
 
+# Maximum number of users whose tweets are fetched at the same time
+MAX_CONCURRENT_USERS = 10
+
+# How tweets are fetched: "timeline", "search" or "auto" (picked per user)
+FETCH_STRATEGY: FetchStrategy = "auto"
+
+# Rank several tweets per LLM call instead of one call per tweet
+BATCH_RANK = False
+
+# Reuse LLM outputs for calls already made with the same model, prompt and inputs
+USE_LLM_CACHE = True
+
 
 def load_config() -> dict:
     """Load configuration from keys/key.yaml file."""
@@ -46,19 +70,34 @@ def print_timing(start_time, operation_name):
 
 
 def initialize_database():
-    # Initialize database and create tables
+    # The tables are created (and migrated) the first time the database is opened
     db = NewsDatabase(db_path)
     return db
 
 
-def get_tweets_function() -> list[Tweet]:
+def get_run_days(start_day: str, end_day: str) -> list[str]:
+    """Get every day (YYYY-MM-DD) from start_day to end_day, inclusive"""
+    start_date, end_date = parse_date_range(start_day, end_day)
+    return [
+        (start_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+        for offset in range((end_date - start_date).days + 1)
+    ]
+
+
+def get_tweets_function(
+    start_day: str = RUN_DAY,
+    end_day: str | None = None,
+    strategy: FetchStrategy = FETCH_STRATEGY,
+    replay: bool = False,
+) -> list[Tweet]:
     start_time = time.time()
     print("\nStarting tweet collection...")
 
-    # Raise a warning if RUN_DAY is over 7 days ago
-    if (datetime.now() - datetime.strptime(RUN_DAY, "%Y-%m-%d")).days > 7:
+    # Raise a warning if the start day is over 7 days ago
+    # (replays read archived pages, so old days are fine)
+    if not replay and (datetime.now() - datetime.strptime(start_day, "%Y-%m-%d")).days > 7:
         input(
-            f"Warning: RUN_DAY is over 7 days ago: {RUN_DAY}!!! \nPress Enter to continue..."
+            f"Warning: start day is over 7 days ago: {start_day}!!! \nPress Enter to continue..."
         )
 
     # Make sure database is ready
@@ -67,79 +106,170 @@ def get_tweets_function() -> list[Tweet]:
     user_list = get_people_usernames(use_test_data=GET_TEST_DATA)
     # user_list.extend(get_organization_usernames())
 
-    # Use the specific run date
-    stop_date = datetime.strptime(RUN_DAY, "%Y-%m-%d").strftime("%Y-%m-%d")
-
-    all_tweets = []
-    for user in user_list:
-        tweets = get_tweets(user, stop_date)
-        all_tweets.extend(tweets)
-        # print(f"Retrieved {len(tweets)} tweets for {user}")
+    if replay:
+        # Re-parse the archived raw pages instead of calling the API
+        # Every archived page is reprocessed, so skip the incremental fetch state
+        client = TwitterClient(archive=PageArchive(), replay=True)
+        all_tweets, reports, embedded = collect_tweets(
+            user_list,
+            start_day,
+            max_concurrency=MAX_CONCURRENT_USERS,
+            client=client,
+            end_date=end_day,
+            strategy=strategy,
+        )
+        db.save_tweets(all_tweets)
+    else:
+        client = get_default_client()
+        # Fetch every user's timeline concurrently, paging each timeline once
+        # for the whole date range
+        # Only tweets newer than the stored ones are fetched, and every page is
+        # saved to the database as it arrives
+        all_tweets, reports, embedded = collect_tweets(
+            user_list,
+            start_day,
+            max_concurrency=MAX_CONCURRENT_USERS,
+            client=client,
+            db=db,
+            end_date=end_day,
+            strategy=strategy,
+        )
+    print_fetch_reports(reports)
 
-    # Save the tweets to the database
-    for tweet in all_tweets:
-        db.save_tweet_object(tweet)
-        # print(tweet.text)
+    # Store the quoted and replied-to tweets so the ranker can use them as context
+    # (quoted tweets embedded in the pages are stored without another API call)
+    hydrate_linked_tweets(db, all_tweets, client, embedded)
 
     print_timing(start_time, "Tweet collection")
     return all_tweets
 
 
+async def rank_tweets_async(
+    db: NewsDatabase,
+    tweet_list: list[Tweet],
+    linked_tweets: dict[str, Tweet],
+    link_summaries: dict[str, list[LinkContent]],
+    rank_model_type: Optional[ModelType] = None,
+    ollama_host: Optional[str] = None,
+    batch_rank: bool = BATCH_RANK,
+    use_cache: bool = USE_LLM_CACHE,
+) -> list[Rank]:
+    rank_list = []
+
+    # Set when the writer fails, ranking goes on but later ranks aren't saved
+    writer_error = None
+
+    # Build the model and agent once for the whole run, and save the ranks (and
+    # cached LLM outputs) through one writer as they finish
+    try:
+        async with AsyncDatabaseWriter(db) as writer:
+            cache = LLMCache(db, writer=writer) if use_cache else None
+            async with RankingEngine(rank_model_type, ollama_host, cache=cache) as engine:
+                # The prompt templates the ranks reference
+                await writer.put_many(loaded_prompt_records())
+
+                async for tweet, rank in engine.arank_all(
+                    tweet_list, linked_tweets, link_summaries, batch=batch_rank
+                ):
+                    # Save the rank to the database
+                    # NOTE: this can save duplicate ranks
+                    try:
+                        await writer.put(rank)
+                    except DatabaseWriterError as e:
+                        writer_error = e
+
+                    # Limit the length of the tweet text for printing
+                    print_limit = 60
+                    if len(tweet.text) > print_limit:
+                        # Remove new lines for printing
+                        text = tweet.text.replace("\n", " ")
+                        print(
+                            f"Ranked {tweet.username} | '{text[0:print_limit]}...' | Score: {rank.score}"
+                        )
+                    else:
+                        print(
+                            f"Ranked {tweet.username} | '{tweet.text}' | Score: {rank.score}"
+                        )
+                    # Save the rank to the list
+                    rank_list.append(rank)
+    except DatabaseWriterError as e:
+        writer_error = e
+
+    if writer_error is not None:
+        print(f"Not every rank was saved, {writer_error}: {writer_error.__cause__}")
+    else:
+        print(f"Saved {len(rank_list)} ranks, up to {engine.max_concurrency} LLM calls at a time")
+    if cache is not None:
+        print(f"LLM cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+    return rank_list
+
+
 def rank_tweets_function(
     tweet_list: list[Tweet] | None = None,
     rank_model_type: Optional[ModelType] = None,
     ollama_host: Optional[str] = None,
+    run_day: str = RUN_DAY,
+    batch_rank: bool = BATCH_RANK,
+    use_cache: bool = USE_LLM_CACHE,
 ):
     start_time = time.time()
-    print("\nStarting tweet ranking...")
+    print(f"\nStarting tweet ranking for {run_day}...")
 
-    rank_list = []
     # Initialize the database
     db = initialize_database()
 
     if tweet_list is None:
-        # Pull in all tweets from the specific run date from the database
+        # Pull in the tweets from the specific run date that aren't ranked yet
+        # (a rerun or a resumed run only ranks what's left)
         # Exclude retweets as the text is cut off!
         # Run the following sql query:
-        sql_query = f"""
+        sql_query = """
         SELECT * FROM tweet
-        WHERE date(created_at) = '{RUN_DAY}'
-        and tweet_type != 'retweet';
+        WHERE created_date = ?
+        and tweet_type != 'retweet'
+        and tweet_id NOT IN (SELECT tweet_id FROM rank);
         """
 
         # Use the execute_query method to get the tweets
-        tweet_list = db.execute_query(sql_query, return_type=Tweet)
+        tweet_list = db.execute_query(sql_query, (run_day,), return_type=Tweet)
 
         print(
-            f"Retrieved {len(tweet_list)} tweets from the specific run date: {RUN_DAY}"
+            f"Retrieved {len(tweet_list)} unranked tweets from the specific run date: {run_day}"
         )
 
     if tweet_list:
+        # Only rank each tweet once, even if several users retweeted it
+        tweet_list = unique_tweets(tweet_list)
+
         # Limit the number of tweets for testing
         # tweet_list = tweet_list[:3]
 
-        for tweet in tweet_list:
-            rank = rank_tweet(tweet, rank_model_type, ollama_host)
-            # Save the rank to the database
-            # NOTE: this can save duplicate ranks
-            db.save_rank_object(rank)
-
-            # Limit the length of the tweet text for printing
-            print_limit = 60
-            if len(tweet.text) > print_limit:
-                # Remove new lines for printing
-                text = tweet.text.replace("\n", " ")
-                print(
-                    f"Saved rank for {tweet.username} | '{text[0:print_limit]}...' | Score: {rank.score}"
-                )
-            else:
-                print(
-                    f"Saved rank for {tweet.username} | '{tweet.text}' | Score: {rank.score}"
-                )
-            # Save the rank to the list
-            rank_list.append(rank)
+        # Look up the quoted and replied-to tweets to give the ranker context
+        linked_ids = [tweet.linked_tweet_id for tweet in tweet_list if tweet.linked_tweet_id]
+        linked_tweets = {
+            linked.tweet_id: linked for linked in db.get_tweets_by_ids(linked_ids)
+        }
+
+        # Fetch the pages the tweets link to (each link once, cached across days)
+        unfurl_links(db, tweet_list)
+        link_summaries = get_link_summaries(db, tweet_list)
+
+        # Rank the tweets concurrently, saving each rank as it comes in
+        rank_list = asyncio.run(
+            rank_tweets_async(
+                db,
+                tweet_list,
+                linked_tweets,
+                link_summaries,
+                rank_model_type,
+                ollama_host,
+                batch_rank,
+                use_cache,
+            )
+        )
     else:
-        raise ValueError("No tweets found!")
+        print(f"No tweets left to rank for {run_day}")
+        rank_list = []
 
     print_timing(start_time, "Tweet ranking")
     return rank_list
@@ -149,19 +279,22 @@ def write_article_function(
     rank_list: list[Rank] | None = None,
     article_model_type: Optional[ModelType] = None,
     ollama_host: Optional[str] = None,
+    run_day: str = RUN_DAY,
+    use_cache: bool = USE_LLM_CACHE,
 ) -> Article:
     start_time = time.time()
-    print("\nStarting article generation...")
+    print(f"\nStarting article generation for {run_day}...")
 
-    # Collect tweet data from provided ranks or from database
-    tweets_df = collect_tweets_for_article(rank_list, RUN_DAY)
+    # Collect tweet data from provided ranks or from all of the day's ranks in the database
+    tweets_df = collect_tweets_for_article(rank_list, run_day)
 
     # Generate and get the article
-    article = create_article(tweets_df, article_model_type, ollama_host)
-
-    # Save article to database
     db = initialize_database()
-    db.save_article_object(article)
+    cache = LLMCache(db) if use_cache else None
+    article = create_article(tweets_df, article_model_type, ollama_host, cache)
+
+    # Save article to database, with the prompt templates it was written with
+    db.save_objects([*loaded_prompt_records(), article])
     print(f"Article saved to database with title: {article.title}")
 
     print_timing(start_time, "Article generation")
@@ -179,16 +312,24 @@ def create_podcast_function():
     print_timing(start_time, "Podcast creation")
 
 
-def run_everything(rank_model_type: Optional[ModelType] = None, article_model_type: Optional[ModelType] = None, ollama_host: Optional[str] = None):
+def run_everything(rank_model_type: Optional[ModelType] = None, article_model_type: Optional[ModelType] = None, ollama_host: Optional[str] = None, run_days: list[str] | None = None, fetch_strategy: FetchStrategy = FETCH_STRATEGY, replay: bool = False, batch_rank: bool = BATCH_RANK, use_cache: bool = USE_LLM_CACHE):
     total_start_time = time.time()
     print("\nStarting full pipeline execution...")
 
-    tweet_list = get_tweets_function()
-    rank_list = rank_tweets_function(
-        tweet_list, rank_model_type=rank_model_type, ollama_host=ollama_host
-    )
-    write_article_function(rank_list, article_model_type=article_model_type, ollama_host=ollama_host)
-    # create_podcast_function()
+    if run_days is None:
+        run_days = [RUN_DAY]
+
+    # Get the tweets for every day at once, then rank and write an article per day
+    # Only new tweets are fetched, so ranking and the article read the whole day from
+    # the database (tweets saved by an earlier or crashed run included)
+    get_tweets_function(run_days[0], run_days[-1], fetch_strategy, replay)
+
+    for run_day in run_days:
+        rank_tweets_function(
+            rank_model_type=rank_model_type, ollama_host=ollama_host, run_day=run_day, batch_rank=batch_rank, use_cache=use_cache
+        )
+        write_article_function(article_model_type=article_model_type, ollama_host=ollama_host, run_day=run_day, use_cache=use_cache)
+        # create_podcast_function()
 
     print_timing(total_start_time, "Full pipeline")
 
@@ -211,9 +352,45 @@ def main():
         "-pa", "--paid", action="store_true", help="Use paid models (fast for ranking, smart for article generation)"
     )
     parser.add_argument("-lo", "--local", action="store_true", help="Use local LLM")
+    parser.add_argument(
+        "--from", dest="from_day", help="First day to run for (YYYY-MM-DD), defaults to RUN_DAY"
+    )
+    parser.add_argument(
+        "--to", dest="to_day", help="Last day to run for (YYYY-MM-DD), defaults to --from"
+    )
+    parser.add_argument(
+        "--fetch-strategy",
+        choices=["timeline", "search", "auto"],
+        default=FETCH_STRATEGY,
+        help="Page back through timelines, use the advanced search for the date range, or pick per user (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--replay", action="store_true", help="Read tweets from the raw page archive instead of the Twitter API"
+    )
+    parser.add_argument(
+        "--batch-rank", action="store_true", default=BATCH_RANK, help="Rank several tweets per LLM call"
+    )
+    parser.add_argument(
+        "--no-cache", dest="use_cache", action="store_false", default=USE_LLM_CACHE, help="Call the LLM again instead of reusing cached outputs"
+    )
+    parser.add_argument(
+        "--archive",
+        type=int,
+        metavar="DAYS",
+        help="Move tweets and ranks older than DAYS days to the Parquet archive, vacuum the database and exit",
+    )
 
     args = parser.parse_args()
 
+    if args.archive is not None:
+        archive_old_rows(initialize_database(), args.archive)
+        print_timing(total_start_time, "Archiving")
+        return
+
+    # Days to run for, every stage runs once per day
+    from_day = args.from_day or RUN_DAY
+    run_days = get_run_days(from_day, args.to_day or from_day)
+
     # Load configuration
     config = load_config()
     ollama_host = config.get("ollama_host")
@@ -241,18 +418,20 @@ def main():
             raise ValueError("No model type provided (use --free, --paid, or --local)")
 
     if args.everything:
-        run_everything(rank_model_type=rank_model_type, article_model_type=article_model_type, ollama_host=ollama_host)
+        run_everything(rank_model_type=rank_model_type, article_model_type=article_model_type, ollama_host=ollama_host, run_days=run_days, fetch_strategy=args.fetch_strategy, replay=args.replay, batch_rank=args.batch_rank, use_cache=args.use_cache)
     elif args.tweets:
-        get_tweets_function()
+        get_tweets_function(run_days[0], run_days[-1], args.fetch_strategy, args.replay)
     elif args.rank:
-        rank_tweets_function(rank_model_type=rank_model_type, ollama_host=ollama_host)
+        for run_day in run_days:
+            rank_tweets_function(rank_model_type=rank_model_type, ollama_host=ollama_host, run_day=run_day, batch_rank=args.batch_rank, use_cache=args.use_cache)
     elif args.article:
-        write_article_function(article_model_type=article_model_type, ollama_host=ollama_host)
+        for run_day in run_days:
+            write_article_function(article_model_type=article_model_type, ollama_host=ollama_host, run_day=run_day, use_cache=args.use_cache)
     elif args.podcast:
         create_podcast_function()
     else:
         # If no arguments provided, run everything as default
-        run_everything(rank_model_type=rank_model_type, article_model_type=article_model_type, ollama_host=ollama_host)
+        run_everything(rank_model_type=rank_model_type, article_model_type=article_model_type, ollama_host=ollama_host, run_days=run_days, fetch_strategy=args.fetch_strategy, replay=args.replay, batch_rank=args.batch_rank, use_cache=args.use_cache)
 
     print_timing(total_start_time, "Total execution")
 
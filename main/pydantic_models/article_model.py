@@ -21,7 +21,11 @@ class Article(SQLModel, table=True):
         default_factory=datetime.now, description="When the article was generated"
     )
     model: str | None = None
+    # Full prompt, only set on articles saved before the prompt registry
     prompt: str | None = None
+    # prompt_template version and the inputs it was rendered with
+    prompt_version: str | None = None
+    prompt_inputs: Dict[str, Any] | None = Field(default=None, sa_column=Column(JSON))
 
     @classmethod
     def from_db_row(cls, row: Dict[str, Any]) -> "Article":
@@ -36,11 +40,17 @@ class Article(SQLModel, table=True):
             created_at=row["created_at"],
             model=row.get("model"),
             prompt=row.get("prompt"),
+            prompt_version=row.get("prompt_version"),
+            prompt_inputs=row.get("prompt_inputs"),
         )
 
     @classmethod
     def from_llm_article(
-        cls, llm_article: LLMArticle, model: str = None, prompt: str = None
+        cls,
+        llm_article: LLMArticle,
+        model: str = None,
+        prompt_version: str = None,
+        prompt_inputs: Dict[str, Any] = None,
     ) -> "Article":
         """Create a full Article object from an LLMArticle object and additional metadata"""
         return cls(
@@ -50,12 +60,17 @@ class Article(SQLModel, table=True):
             daily_summary=llm_article.daily_summary,
             top_stories=llm_article.top_stories,
             model=model,
-            prompt=prompt,
+            prompt_version=prompt_version,
+            prompt_inputs=prompt_inputs,
         )
 
     @classmethod
     def from_llm_article_v2(
-        cls, llm_article: LLMArticleV2, model: str = None, prompt: str = None
+        cls,
+        llm_article: LLMArticleV2,
+        model: str = None,
+        prompt_version: str = None,
+        prompt_inputs: Dict[str, Any] = None,
     ) -> "Article":
         """Create a full Article object from an LLMArticleV2 object and additional metadata"""
         # Import here to avoid circular imports
@@ -89,7 +104,8 @@ class Article(SQLModel, table=True):
             daily_summary=llm_article.daily_summary,
             top_stories=llm_article.top_stories,
             model=model,
-            prompt=prompt,
+            prompt_version=prompt_version,
+            prompt_inputs=prompt_inputs,
         )
 
     def to_dict(self) -> Dict[str, Any]:
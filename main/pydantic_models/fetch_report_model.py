@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+
+
+class UserFetchReport(BaseModel):
+    """
+    Timing and outcome of collecting a single user's tweets.
+    """
+
+    username: str
+    strategy: str = "timeline"
+    tweet_count: int = 0
+    pages: int = 0
+    seconds: float = 0.0
+    error: str | None = None
+
+    def __str__(self) -> str:
+        """String representation of the UserFetchReport"""
+        status = f"FAILED ({self.error})" if self.error else "ok"
+        return f"{self.username} ({self.strategy}): {self.tweet_count} tweets, {self.pages} page(s), {self.seconds:.2f}s - {status}"
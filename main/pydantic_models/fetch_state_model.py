@@ -0,0 +1,29 @@
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+
+
+class FetchState(SQLModel, table=True):
+    """
+    Per-user bookkeeping for incremental tweet fetching.
+    All datetimes are naive UTC, matching how tweet.created_at is stored.
+    """
+
+    __tablename__ = "fetch_state"
+
+    username: str = Field(primary_key=True)
+    # Newest tweet stored for the user (the high-water mark)
+    newest_tweet_id: str | None = None
+    newest_created_at: datetime | None = None
+    # Everything from here up to newest_created_at is already stored
+    covered_since: datetime | None = None
+    # Cursor of the next page of an unfinished walk and the date it was for
+    cursor: str | None = None
+    run_date: str | None = None
+    # Newest tweet stored by the unfinished walk, committed once the walk completes
+    pending_tweet_id: str | None = None
+    pending_created_at: datetime | None = None
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+    def __str__(self) -> str:
+        """String representation of the FetchState"""
+        return f"FetchState(user={self.username}, newest={self.newest_created_at}, covered_since={self.covered_since}, cursor={self.cursor})"
@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+from sqlmodel import SQLModel, Field
+
+
+class LinkContent(SQLModel, table=True):
+    """
+    Text extracted from a link found in a tweet, cached so each link is fetched once.
+    fetched_at is naive UTC, matching the other tables.
+    """
+
+    __tablename__ = "link_content"
+
+    # URL as it appears in the tweet (usually a t.co short link)
+    url: str = Field(primary_key=True)
+    # Where the link ends up after redirects, shared by every alias of the same page
+    final_url: str | None = Field(default=None, index=True)
+    title: str | None = None
+    text: str | None = None
+    summary: str | None = None
+    status_code: int | None = None
+    error: str | None = None
+    fetched_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None)
+    )
+
+    def __str__(self) -> str:
+        """String representation of the LinkContent"""
+        return f"LinkContent(url={self.url}, final_url={self.final_url}, status={self.status_code})"
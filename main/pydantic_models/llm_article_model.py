@@ -26,7 +26,7 @@ class LLMArticleV2(BaseModel):
     content: list[dict[str, str | list[str]]] = Field(
         description="""A list of JSON dictionaries. Each of these dictionaries has the following key/value pairs. 
     1. key:"paragraph_text", value: The string text of a paragraph of the article.
-    2. key:"relevant_tweet_ids_list", value: a python list of the string UUID tweet ids relevant to the paragraph you just created. All relevant tweet ids that the paragraph references or uses information from must be included here!
+    2. key:"relevant_tweet_ids_list", value: a python list of the string tweet ids relevant to the paragraph you just created. All relevant tweet ids that the paragraph references or uses information from must be included here!
     """
     )
     summary: str = Field(
@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+from sqlmodel import SQLModel, Field
+
+
+class LLMCacheEntry(SQLModel, table=True):
+    """
+    A cached LLM output, keyed by a hash of everything that went into the call.
+    created_at is naive UTC, matching the other tables.
+    """
+
+    __tablename__ = "llm_cache"
+
+    # SHA-256 of the model, prompt template version, output type and inputs
+    key: str = Field(primary_key=True)
+    model: str
+    prompt_version: str
+    # The output model as JSON
+    output: str
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None),
+        index=True,
+    )
+
+    def __str__(self) -> str:
+        """String representation of the LLMCacheEntry"""
+        return f"LLMCacheEntry(key={self.key[:12]}, model={self.model}, prompt_version={self.prompt_version})"
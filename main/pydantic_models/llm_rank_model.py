@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class LLMRank(BaseModel):
@@ -9,3 +9,20 @@ class LLMRank(BaseModel):
 
     reason: str
     score: int
+
+
+class LLMTweetRank(LLMRank):
+    """An LLMRank for one tweet of a batch, keyed by the tweet's ID"""
+
+    tweet_id: str = Field(description="The ID of the tweet this rank is for")
+
+
+class LLMRankBatch(BaseModel):
+    """
+    Model for the LLM to fill out when ranking several tweets in one call.
+    Contains one rank per tweet it was given.
+    """
+
+    ranks: list[LLMTweetRank] = Field(
+        description="One rank for every tweet given, each with that tweet's ID"
+    )
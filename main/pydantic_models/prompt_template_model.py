@@ -0,0 +1,22 @@
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+
+
+class PromptTemplate(SQLModel, table=True):
+    """
+    A prompt template as it was used, stored once per version.
+    Ranks and articles point at it with prompt_version and only store their own inputs.
+    """
+
+    __tablename__ = "prompt_template"
+
+    # Content hash of the template source
+    version: str = Field(primary_key=True)
+    # Template file, relative to main/llm (e.g. "rank/rank_prompt_v3.jinja")
+    name: str
+    source: str
+    created_at: datetime = Field(default_factory=datetime.now)
+
+    def __str__(self) -> str:
+        """String representation of the PromptTemplate"""
+        return f"PromptTemplate(name={self.name}, version={self.version})"
@@ -1,18 +1,28 @@
 from datetime import datetime
 from typing import Dict, Any
 from uuid import uuid4
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index, Column
+from sqlalchemy import JSON
 from pydantic_models.llm_rank_model import LLMRank
 
 
 class Rank(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_rank_tweet_id_score", "tweet_id", "score"),
+        Index("ix_rank_score", "score"),
+    )
+
     rank_id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True)
     tweet_id: str
     run_time: datetime
     reason: str
     score: int
     model: str | None = None
+    # Full prompt, only set on ranks saved before the prompt registry
     prompt: str | None = None
+    # prompt_template version and the inputs it was rendered with
+    prompt_version: str | None = None
+    prompt_inputs: Dict[str, Any] | None = Field(default=None, sa_column=Column(JSON))
 
     @classmethod
     def from_db_row(cls, row: Dict[str, Any]) -> "Rank":
@@ -24,7 +34,9 @@ class Rank(SQLModel, table=True):
             reason=row["reason"],
             score=row["score"],
             model=row["model"],
-            prompt=row["prompt"],
+            prompt=row.get("prompt"),
+            prompt_version=row.get("prompt_version"),
+            prompt_inputs=row.get("prompt_inputs"),
         )
 
     @classmethod
@@ -40,7 +52,12 @@ class Rank(SQLModel, table=True):
 
     @classmethod
     def from_llm_rank(
-        cls, llm_rank: LLMRank, tweet_id: str, model: str = None, prompt: str = None
+        cls,
+        llm_rank: LLMRank,
+        tweet_id: str,
+        model: str = None,
+        prompt_version: str = None,
+        prompt_inputs: Dict[str, Any] = None,
     ) -> "Rank":
         """Create a full Rank object from an LLMRank object and additional metadata"""
         return cls(
@@ -49,7 +66,8 @@ class Rank(SQLModel, table=True):
             reason=llm_rank.reason,
             score=llm_rank.score,
             model=model,
-            prompt=prompt,
+            prompt_version=prompt_version,
+            prompt_inputs=prompt_inputs,
         )
 
     def to_dict(self) -> Dict[str, Any]:
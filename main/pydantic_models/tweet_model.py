@@ -1,10 +1,21 @@
 from datetime import datetime
 from typing import Dict, Any
 from uuid import uuid4
-from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, Computed, String
+from sqlmodel import SQLModel, Field, Index
 
 
 class Tweet(SQLModel, table=True):
+    __table_args__ = (
+        # The (UTC) day a tweet was created, stored so queries by day can use an index
+        # It's only a table column, the database fills it in
+        Column("created_date", String, Computed("date(created_at)", persisted=True)),
+        # Matches tweets saved before they were keyed by native ID (see save_tweets)
+        # Not unique, a user can post twice within the same second
+        Index("ix_tweet_username_created_at", "username", "created_at"),
+        Index("ix_tweet_created_date", "created_date"),
+    )
+
     tweet_id: str = Field(default_factory=lambda: str(uuid4()), primary_key=True)
     username: str
     url: str | None = None
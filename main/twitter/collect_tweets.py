@@ -0,0 +1,197 @@
+import asyncio
+import datetime
+import time
+from typing import List
+import httpx
+from pydantic_models.tweet_model import Tweet
+from pydantic_models.fetch_report_model import UserFetchReport
+from twitter.twitter_client import TwitterClient, TwitterAPIError, get_default_client
+from twitter.fetch_state import prepare_fetch, asave_fetched_page
+from twitter.fetch_strategy import FetchStrategy
+from twitter.get_tweets import parse_date_range, unique_tweets
+from twitter.tweet_records import TweetRecord, records_to_tweets
+from db.database import NewsDatabase
+from db.async_writer import AsyncDatabaseWriter, DatabaseWriterError
+
+
+async def fetch_user_tweets(
+    client: TwitterClient,
+    semaphore: asyncio.Semaphore,
+    username: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    writer: AsyncDatabaseWriter | None = None,
+    strategy: FetchStrategy = "timeline",
+) -> tuple[List[Tweet], List[TweetRecord], UserFetchReport]:
+    """
+    Fetches one user's tweets from the date range without blocking the other users.
+
+    Args:
+        client: Shared TwitterClient holding the pooled async connections
+        semaphore: Limits how many users are fetched at the same time
+        username: Twitter username without the @ symbol
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+        writer: When given, fetch incrementally and queue each page on it as it arrives
+        strategy: "timeline", "search" or "auto" (see twitter/fetch_strategy.py)
+
+    Returns:
+        Tuple of the collected Tweet objects, the quoted tweets embedded in the pages
+        and the fetch report for the user
+    """
+    user_tweets = []
+    embedded = []
+    if client.replay:
+        # Replays read every archived page of the user rather than walking cursors,
+        # so there's no fetch state, and "auto" replays pages of both endpoints
+        state = None
+        pages = client.aiter_archived_pages(username, start_date, end_date, strategy)
+    else:
+        # Read the fetch state on a worker thread, so the other users keep going
+        state, cursor, stop_at, strategy = await asyncio.to_thread(
+            prepare_fetch,
+            writer.db if writer else None,
+            username,
+            start_date,
+            end_date,
+            strategy,
+        )
+        if strategy == "search":
+            pages = client.aiter_search_pages(
+                username, start_date, end_date, cursor, stop_at
+            )
+        else:
+            pages = client.aiter_tweet_pages(
+                username, start_date, end_date, cursor, stop_at
+            )
+    report = UserFetchReport(username=username, strategy=strategy)
+
+    async with semaphore:
+        start_time = time.perf_counter()
+        try:
+            async for page in pages:
+                report.pages += 1
+                embedded.extend(page.embedded)
+                if state is not None:
+                    user_tweets.extend(
+                        await asave_fetched_page(writer, state, page, start_date)
+                    )
+                else:
+                    user_tweets.extend(records_to_tweets(page.tweets))
+        except TwitterAPIError as e:
+            # Keep the tweets we already have, but mark the user as failed
+            report.error = str(e)
+        except (httpx.HTTPError, ValueError) as e:
+            report.error = f"{type(e).__name__}: {e}"
+        except DatabaseWriterError as e:
+            # The pages can't be saved any more, the other users keep going
+            report.error = f"{e}: {e.__cause__}"
+        report.seconds = time.perf_counter() - start_time
+        if client.replay and report.pages == 0:
+            report.error = "No archived pages"
+
+    if writer is not None and report.error is None:
+        # Only report the user as ok once their pages are committed
+        try:
+            await writer.flush()
+        except DatabaseWriterError as e:
+            report.error = f"{e}: {e.__cause__}"
+
+    report.tweet_count = len(user_tweets)
+    return user_tweets, embedded, report
+
+
+async def collect_tweets_async(
+    usernames: list[str],
+    stop_date: str,
+    max_concurrency: int = 10,
+    client: TwitterClient | None = None,
+    db: NewsDatabase | None = None,
+    end_date: str | None = None,
+    strategy: FetchStrategy = "timeline",
+) -> tuple[List[Tweet], list[UserFetchReport], List[TweetRecord]]:
+    """
+    Fetches the tweets of every user in the list concurrently.
+
+    Args:
+        usernames: Twitter usernames without the @ symbol
+        stop_date: Date string in format "YYYY-MM-DD" - will collect tweets from this date
+        max_concurrency: Maximum number of users fetched at the same time
+        client: TwitterClient to fetch with (defaults to the shared client)
+        db: When given, only fetch tweets newer than the stored ones and save pages as they arrive
+        end_date: Last date string in format "YYYY-MM-DD" to collect (defaults to stop_date).
+            Each user's timeline is only paged once for the whole range.
+        strategy: "timeline", "search" or "auto" to pick per user from their tweet volume
+
+    Returns:
+        Tuple of all collected (unique) Tweet objects, one fetch report per user and
+        the quoted tweets embedded in the pages (for hydrate_linked_tweets)
+    """
+    if client is None:
+        client = get_default_client()
+
+    start_date, last_date = parse_date_range(stop_date, end_date)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    # One writer commits every user's pages, in groups
+    writer = AsyncDatabaseWriter(db) if db is not None else None
+    try:
+        if writer is not None:
+            writer.start()
+        results = await asyncio.gather(
+            *(
+                fetch_user_tweets(
+                    client, semaphore, username, start_date, last_date, writer, strategy
+                )
+                for username in usernames
+            )
+        )
+    finally:
+        if writer is not None:
+            try:
+                await writer.close()
+            except DatabaseWriterError as e:
+                # Already reported for the users whose pages weren't saved
+                print(f"{e}: {e.__cause__}")
+        # The async connection pool is tied to this event loop
+        await client.aclose()
+
+    all_tweets = []
+    reports = []
+    all_embedded = []
+    for user_tweets, embedded, report in results:
+        all_tweets.extend(user_tweets)
+        all_embedded.extend(embedded)
+        reports.append(report)
+    # Originals retweeted by several users come back once per retweet
+    return unique_tweets(all_tweets), reports, all_embedded
+
+
+def collect_tweets(
+    usernames: list[str],
+    stop_date: str,
+    max_concurrency: int = 10,
+    client: TwitterClient | None = None,
+    db: NewsDatabase | None = None,
+    end_date: str | None = None,
+    strategy: FetchStrategy = "timeline",
+) -> tuple[List[Tweet], list[UserFetchReport], List[TweetRecord]]:
+    """Synchronous entry point for collect_tweets_async."""
+    return asyncio.run(
+        collect_tweets_async(
+            usernames, stop_date, max_concurrency, client, db, end_date, strategy
+        )
+    )
+
+
+def print_fetch_reports(reports: list[UserFetchReport]) -> None:
+    """Print the per-user timings, slowest first, followed by any failures."""
+    print("\nPer-user fetch timings:")
+    for report in sorted(reports, key=lambda r: r.seconds, reverse=True):
+        print(f"- {report}")
+
+    failures = [report for report in reports if report.error]
+    if failures:
+        print(f"\n{len(failures)} of {len(reports)} user(s) failed:")
+        for report in failures:
+            print(f"- {report.username}: {report.error}")
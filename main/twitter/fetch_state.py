@@ -0,0 +1,196 @@
+import datetime
+from typing import List, TYPE_CHECKING
+from pydantic_models.fetch_state_model import FetchState
+from pydantic_models.tweet_model import Tweet
+from twitter.tweet_records import records_to_tweets
+from twitter.fetch_strategy import FetchStrategy, choose_fetch_strategy
+
+if TYPE_CHECKING:
+    from db.async_writer import AsyncDatabaseWriter
+    from db.database import NewsDatabase
+    from twitter.get_tweets import PageResult
+
+
+def day_start(day: datetime.date) -> datetime.datetime:
+    """Midnight (naive UTC) at the start of the day"""
+    return datetime.datetime.combine(day, datetime.time.min)
+
+
+def plan_fetch(
+    state: FetchState | None,
+    username: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    strategy: str = "timeline",
+) -> tuple[FetchState, str, datetime.datetime | None]:
+    """
+    Work out where to start paging a user's timeline and where to stop.
+
+    Args:
+        state: Stored fetch state for the user (None on the first run)
+        username: Twitter username without the @ symbol
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+        strategy: Fetch strategy of the walk ("timeline" or "search"), cursors of one
+            strategy can't be used for the other
+
+    Returns:
+        Tuple of the (possibly new) fetch state, the cursor to start from and the
+        creation time of the newest stored tweet to stop at (None to page until the date limit)
+    """
+    if state is None:
+        state = FetchState(username=username)
+
+    run_date = f"{strategy}:{start_date.isoformat()}"
+    if end_date != start_date:
+        run_date = f"{run_date}..{end_date.isoformat()}"
+    cursor = ""
+    if state.cursor and state.run_date == run_date:
+        # The last walk for this date did not finish, pick up where it stopped
+        print(f"Resuming {username} from saved cursor")
+        cursor = state.cursor
+    else:
+        state.cursor = None
+        state.run_date = run_date
+        state.pending_tweet_id = None
+        state.pending_created_at = None
+
+    return state, cursor, get_stop_at(state, start_date)
+
+
+def prepare_fetch(
+    db: "NewsDatabase | None",
+    username: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    strategy: FetchStrategy = "timeline",
+) -> tuple[FetchState | None, str, datetime.datetime | None, str]:
+    """
+    Pick the fetch strategy for a user and where to start and stop paging.
+
+    Args:
+        db: Database with the fetch state and tweet history (None to fetch everything)
+        username: Twitter username without the @ symbol
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+        strategy: Strategy selected for the run ("auto" picks per user from their tweet volume)
+
+    Returns:
+        Tuple of the fetch state (None without a database), the cursor to start from,
+        the creation time of the newest stored tweet to stop at and the resolved strategy
+    """
+    if db is None:
+        return None, "", None, choose_fetch_strategy(strategy, None, start_date, end_date)
+
+    state = db.get_fetch_state(username)
+    strategy = choose_fetch_strategy(
+        strategy,
+        db.get_tweets_per_day(username),
+        start_date,
+        end_date,
+        get_stop_at(state, start_date),
+    )
+    state, cursor, stop_at = plan_fetch(state, username, start_date, end_date, strategy)
+    return state, cursor, stop_at, strategy
+
+
+def get_stop_at(
+    state: FetchState | None, start_date: datetime.date
+) -> datetime.datetime | None:
+    """
+    Get the creation time of the newest stored tweet to stop paging at.
+    Only used if everything below it down to the start of the date range is already stored.
+    """
+    if (
+        state is not None
+        and state.newest_created_at is not None
+        and state.covered_since is not None
+        and state.covered_since <= day_start(start_date)
+    ):
+        return state.newest_created_at
+    return None
+
+
+def advance_fetch_state(
+    state: FetchState, page: "PageResult", start_date: datetime.date
+) -> FetchState:
+    """
+    Update the fetch state after a page has been stored.
+
+    Args:
+        state: Fetch state of the user being fetched
+        page: The page that was just stored
+        start_date: First date the tweets were collected from
+
+    Returns:
+        The updated fetch state
+    """
+    for tweet in page.tweets:
+        # Skip retweet originals, they belong to other users' timelines
+        if tweet.username.lower() != state.username.lower():
+            continue
+        created_at = tweet.created_at.replace(tzinfo=None)
+        if state.pending_created_at is None or created_at > state.pending_created_at:
+            state.pending_created_at = created_at
+            state.pending_tweet_id = tweet.tweet_id
+
+    state.cursor = page.next_cursor
+    state.updated_at = datetime.datetime.now()
+
+    if page.next_cursor is None:
+        # The walk finished, move the high-water mark
+        pending_is_newer = state.pending_created_at is not None and (
+            state.newest_created_at is None
+            or state.pending_created_at > state.newest_created_at
+        )
+        if page.stop_reason == "stored":
+            # New tweets join up with the stored ones
+            if pending_is_newer:
+                state.newest_created_at = state.pending_created_at
+                state.newest_tweet_id = state.pending_tweet_id
+        elif pending_is_newer:
+            # Nothing links the new tweets to the old range, start a new one
+            state.newest_created_at = state.pending_created_at
+            state.newest_tweet_id = state.pending_tweet_id
+            state.covered_since = day_start(start_date)
+        state.run_date = None
+        state.pending_tweet_id = None
+        state.pending_created_at = None
+
+    return state
+
+
+def save_fetched_page(
+    db: "NewsDatabase", state: FetchState, page: "PageResult", start_date: datetime.date
+) -> List[Tweet]:
+    """
+    Store a page's tweets and then the fetch state, so a crash can resume after this page.
+
+    Returns:
+        The Tweet objects built from the page's records
+    """
+    tweets = records_to_tweets(page.tweets)
+    db.save_tweets(tweets)
+    db.save_fetch_state(advance_fetch_state(state, page, start_date))
+    return tweets
+
+
+async def asave_fetched_page(
+    writer: "AsyncDatabaseWriter",
+    state: FetchState,
+    page: "PageResult",
+    start_date: datetime.date,
+) -> List[Tweet]:
+    """
+    Async version of save_fetched_page, queueing the page's tweets and then a snapshot
+    of the fetch state on the database writer.
+
+    Returns:
+        The Tweet objects built from the page's records
+    """
+    tweets = records_to_tweets(page.tweets)
+    await writer.put_many(tweets)
+    # Queue a copy, the state keeps changing with the next pages before it's committed
+    state = advance_fetch_state(state, page, start_date)
+    await writer.put(FetchState(**state.model_dump()))
+    return tweets
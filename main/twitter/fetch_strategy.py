@@ -0,0 +1,83 @@
+import datetime
+import math
+from typing import Literal
+
+# How a user's tweets are fetched:
+# - "timeline" pages back through twitter/user/last_tweets from the newest tweet
+# - "search" asks twitter/tweet/advanced_search for exactly the date range
+# - "auto" picks whichever needs fewer pages for each user
+FetchStrategy = Literal["timeline", "search", "auto"]
+
+# Tweets returned per page by twitterapi.io
+PAGE_SIZE = 20
+
+
+def estimate_pages(
+    tweets_per_day: float,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    stop_at: datetime.datetime | None = None,
+    now: datetime.datetime | None = None,
+) -> dict[str, int]:
+    """
+    Estimate how many pages each strategy needs for a user.
+
+    Args:
+        tweets_per_day: Average number of tweets the user posts per day
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+        stop_at: Creation time of the newest tweet already stored for the user
+        now: Current time in naive UTC (defaults to now)
+
+    Returns:
+        Dictionary with the estimated page count of "timeline" and "search"
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+    # The timeline walks from now back to the start of the range,
+    # or to the newest stored tweet if that is later
+    walk_until = datetime.datetime.combine(start_date, datetime.time.min)
+    if stop_at is not None and stop_at > walk_until:
+        walk_until = stop_at
+    timeline_days = max((now - walk_until).total_seconds() / 86400, 0)
+
+    # The search only covers the range itself
+    search_days = (end_date - start_date).days + 1
+
+    return {
+        "timeline": max(math.ceil(tweets_per_day * timeline_days / PAGE_SIZE), 1),
+        "search": max(math.ceil(tweets_per_day * search_days / PAGE_SIZE), 1),
+    }
+
+
+def choose_fetch_strategy(
+    strategy: FetchStrategy,
+    tweets_per_day: float | None,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    stop_at: datetime.datetime | None = None,
+) -> str:
+    """
+    Resolve the fetch strategy to use for a user.
+
+    Args:
+        strategy: Strategy selected for the run
+        tweets_per_day: Historical tweet volume of the user (None if there is no history)
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+        stop_at: Creation time of the newest tweet already stored for the user
+
+    Returns:
+        "timeline" or "search"
+    """
+    if strategy != "auto":
+        return strategy
+    # Without history, stick to the timeline walk
+    if not tweets_per_day:
+        return "timeline"
+
+    pages = estimate_pages(tweets_per_day, start_date, end_date, stop_at)
+    if pages["search"] < pages["timeline"]:
+        return "search"
+    return "timeline"
@@ -1,9 +1,17 @@
-import requests
-import yaml
 import datetime
-import uuid
-from typing import List
+from typing import List, NamedTuple
 from pydantic_models.tweet_model import Tweet
+from twitter.tweet_records import (
+    TweetRecord,
+    convert_api_tweet,
+    embedded_quoted_tweet,
+    parse_twitter_date,
+    records_to_tweets,
+)
+from twitter.twitter_client import TwitterClient, TwitterAPIError, get_default_client
+from twitter.fetch_state import prepare_fetch, save_fetched_page
+from twitter.fetch_strategy import FetchStrategy
+from db.database import NewsDatabase
 
 
 def parse_tweet_date(tweet_date: str) -> datetime.datetime:
@@ -17,8 +25,12 @@ def parse_tweet_date(tweet_date: str) -> datetime.datetime:
     Returns:
         A datetime.datetime object
     """
+    # Twitter format: "Fri May 09 09:55:55 +0000 2025"
+    parsed_date = parse_twitter_date(tweet_date)
+    if parsed_date is not None:
+        return parsed_date
     try:
-        # Twitter format: "Fri May 09 09:55:55 +0000 2025"
+        # Slower fallback for anything the fast parser doesn't handle
         return datetime.datetime.strptime(tweet_date, "%a %b %d %H:%M:%S %z %Y")
     except ValueError as e:
         print(f"Warning: Could not parse date: {tweet_date}")
@@ -26,309 +38,288 @@ def parse_tweet_date(tweet_date: str) -> datetime.datetime:
         return None
 
 
-def get_tweets(username: str, stop_date: str) -> List[Tweet]:
+def get_tweets(
+    username: str,
+    stop_date: str,
+    client: TwitterClient | None = None,
+    db: NewsDatabase | None = None,
+    end_date: str | None = None,
+    strategy: FetchStrategy = "timeline",
+) -> List[Tweet]:
     """
-    Fetches tweets for a given username from the specified date.
+    Fetches tweets for a given username from the specified date (or date range).
     Returns a list of Tweet objects.
 
     Args:
         username: Twitter username without the @ symbol
         stop_date: Date string in format "YYYY-MM-DD" - will collect tweets from this date
+        client: TwitterClient to fetch with (defaults to the shared client)
+        db: When given, fetch incrementally: stop at tweets that are already stored,
+            save each page as it arrives and resume an interrupted walk from its cursor
+        end_date: Last date string in format "YYYY-MM-DD" to collect (defaults to stop_date).
+            The timeline is only paged once for the whole range.
+        strategy: "timeline" to page back through the user's timeline, "search" to use the
+            advanced search for the date range, or "auto" to pick from the user's tweet volume
 
     Returns:
         List of Tweet objects
     """
-    # Load API keys
-    with open("keys/key.yaml", "r") as f:
-        keys = yaml.safe_load(f)
+    if client is None:
+        client = get_default_client()
 
-    # Convert stop_date to datetime for comparison
-    target_date = datetime.datetime.strptime(stop_date, "%Y-%m-%d").date()
-    # Calculate next day for comparison
-    next_day = target_date + datetime.timedelta(days=1)
+    # Convert the dates to datetime for comparison
+    start_date, last_date = parse_date_range(stop_date, end_date)
 
-    url = "https://api.twitterapi.io/twitter/user/last_tweets"
-    headers = {"X-API-Key": keys["twitter_api_io_key"]}
+    if client.replay:
+        # Replays read every archived page of the user rather than walking cursors
+        state = None
+        pages = client.iter_archived_pages(username, start_date, last_date, strategy)
+    else:
+        state, cursor, stop_at, strategy = prepare_fetch(
+            db, username, start_date, last_date, strategy
+        )
+        if strategy == "search":
+            pages = client.iter_search_pages(username, start_date, last_date, cursor, stop_at)
+        else:
+            pages = client.iter_tweet_pages(username, start_date, last_date, cursor, stop_at)
 
     all_tweets = []
-    cursor = ""
-    reached_date_limit = False
-
-    while not reached_date_limit:
-        querystring = {
-            "userName": username,
-            "cursor": cursor,
-        }
-
-        response = requests.request("GET", url, headers=headers, params=querystring)
-
-        if response.status_code != 200:
-            print(f"Error: {response.status_code}")
-            print(response.text)
-            break
-
-        full_data = response.json()
-
-        # The API response has tweets in data.tweets, not directly in data
-        if "data" in full_data and "tweets" in full_data["data"]:
-            tweets = full_data["data"]["tweets"]
-
-            for tweet_data in tweets:
-                if "createdAt" in tweet_data:
-                    # Parse the tweet date
-                    created_at_str = tweet_data["createdAt"]
-                    try:
-                        tweet_date = parse_tweet_date(created_at_str)
-                        if tweet_date is None:
-                            print(f"Warning: Could not parse date: {created_at_str}")
-                            continue
-                    except ValueError:
-                        print(f"Warning: Could not parse date: {created_at_str}")
-                        continue
-
-                    # If tweet is before target date, stop collecting
-                    if tweet_date.date() < target_date:
-                        print(
-                            f"Reached tweet from {tweet_date} which is before target date {target_date}"
-                        )
-                        reached_date_limit = True
-                        # Break out of the loop for the last 20 tweets
-                        break
-
-                    # If tweet is from target date, add it
-                    if tweet_date.date() == target_date:
-                        # Convert the API tweet to our Tweet object
-                        tweet_objs = _convert_api_tweet_to_tweet_object(tweet_data)
-                        if tweet_objs:
-                            all_tweets.extend(tweet_objs)
-                    # If tweet is after target date, skip it
-                    elif tweet_date.date() >= next_day:
-                        continue
-
-            # Break out of the while loop
-            if reached_date_limit:
-                break
-
-            len_tweets = len(tweets)
-            has_next_page = full_data.get("has_next_page", False)
-
-            # Check if there are more pages
-            if len_tweets == 20 and has_next_page:
-                cursor = full_data.get("next_cursor", "")
-                if cursor == "":
-                    raise ValueError(
-                        f"No cursor found for {username} but has_next_page is True"
-                    )
+    try:
+        for page in pages:
+            if state is not None:
+                all_tweets.extend(save_fetched_page(db, state, page, start_date))
             else:
-                if len_tweets != 20 and not has_next_page:
-                    print(
-                        f"Stopping due to <20 tweets and no more pages for {username}"
-                    )
-                elif len_tweets != 20:
-                    print(f"Stopping due to <20 tweets for {username}")
-                elif not has_next_page:
-                    print(f"Stopping due to no more pages for {username}")
-                else:
-                    raise ValueError(
-                        f"Not sure why tweets are not 20 and there are no more pages for {username}."
-                    )
-                break
-        else:
-            print("No tweets found in response")
-            break
-
-    print(f"Total tweets collected for {username} on {stop_date}: {len(all_tweets)}")
+                all_tweets.extend(records_to_tweets(page.tweets))
+    except TwitterAPIError as e:
+        print(f"Error: {e.status_code}")
+        print(e.text)
+
+    print(
+        f"Total tweets collected for {username} from {start_date} to {last_date}: {len(all_tweets)}"
+    )
     return all_tweets
 
 
-def _convert_api_tweet_to_tweet_object(tweet_data: dict) -> List[Tweet]:
+def parse_date_range(
+    stop_date: str, end_date: str | None = None
+) -> tuple[datetime.date, datetime.date]:
     """
-    Converts a tweet from the Twitter API format to our Tweet object(s).
+    Parses the first and last date to collect tweets for.
 
     Args:
-        tweet_data: Dictionary containing tweet data from the API
+        stop_date: Oldest date string in format "YYYY-MM-DD"
+        end_date: Newest date string in format "YYYY-MM-DD" (defaults to stop_date)
 
     Returns:
-        List of Tweet objects:
-        - For regular tweets: returns a list with a single Tweet object
-        - For retweets: returns a list with the original tweet and the retweet
-        - For replies: returns a list with the original tweet and the reply
+        Tuple of the first and last date of the range
     """
-    result_tweets = []
+    start_date = datetime.datetime.strptime(stop_date, "%Y-%m-%d").date()
+    last_date = start_date
+    if end_date is not None:
+        last_date = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+    if last_date < start_date:
+        raise ValueError(f"End date {end_date} is before start date {stop_date}")
+    return start_date, last_date
 
-    # Get the current tweet's username
-    username = tweet_data["author"].get("userName", "")
-    if not username:
-        raise ValueError(f"Username not found! tweet_data:\n{tweet_data}")
 
-    # Parse created_at for the current tweet
-    created_at_str = tweet_data.get("createdAt", "")
-    created_at = parse_tweet_date(created_at_str)
-    if created_at is None:
-        raise ValueError(
-            f"Can't parse date! \ndate: {created_at_str}\n tweet_data:\n{tweet_data}"
-        )
+def unique_tweets(tweets: List[Tweet]) -> List[Tweet]:
+    """
+    Drops repeated tweets (by tweet ID), keeping the first one.
+    An original retweeted by several tracked users is only kept once.
+    """
+    seen_ids = set()
+    result = []
+    for tweet in tweets:
+        if tweet.tweet_id not in seen_ids:
+            seen_ids.add(tweet.tweet_id)
+            result.append(tweet)
+    return result
+
+
+class PageResult(NamedTuple):
+    """Outcome of processing one page of a user's timeline."""
+
+    tweets: List[TweetRecord]
+    # Cursor of the next page, None when paging should stop
+    next_cursor: str | None
+    # Why paging stopped: "date", "stored" or "end" (None while paging continues)
+    stop_reason: str | None = None
+    # Quoted tweets that came embedded in the page's tweets, for hydration
+    embedded: tuple[TweetRecord, ...] = ()
+
+
+def process_tweet_page(
+    full_data: dict,
+    username: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    stop_at: datetime.datetime | None = None,
+) -> PageResult:
+    """
+    Processes one page of the "last_tweets" endpoint.
+    Keeps the tweets from the date range and works out if another page is needed.
 
-    # Get text content, URL, and metrics for the current tweet
-    text = tweet_data.get("text", "")
-    url = tweet_data.get("url", "")
-    metrics = tweet_data.get("public_metrics", {})
-    retweet_count = metrics.get("retweet_count", 0) or tweet_data.get("retweetCount", 0)
-    reply_count = metrics.get("reply_count", 0) or tweet_data.get("replyCount", 0)
-    like_count = metrics.get("like_count", 0) or tweet_data.get("likeCount", 0)
-    quote_count = metrics.get("quote_count", 0) or tweet_data.get("quoteCount", 0)
-    view_count = metrics.get("impression_count", 0) or tweet_data.get("viewCount", 0)
-    bookmark_count = tweet_data.get("bookmarkCount", 0)
-
-    # Check tweet type
-    if tweet_data.get("retweeted_tweet"):
-        # CASE 1: This is a retweet
-        # First, create the original tweet
-        original_tweet_data = tweet_data["retweeted_tweet"]
-        original_tweet_id = str(uuid.uuid4())
-
-        original_username = original_tweet_data["author"].get("userName", "")
-
-        # Parse the date of the original tweet
-        original_created_at_str = original_tweet_data.get("createdAt", "")
-        original_created_at = parse_tweet_date(original_created_at_str)
-        if original_created_at is None:
-            # If we can't parse the date of the original tweet, use the retweet date
-            original_created_at = created_at
-
-        # Get original tweet metrics
-        original_metrics = original_tweet_data.get("public_metrics", {})
-        original_retweet_count = original_metrics.get(
-            "retweet_count", 0
-        ) or original_tweet_data.get("retweetCount", 0)
-        original_reply_count = original_metrics.get(
-            "reply_count", 0
-        ) or original_tweet_data.get("replyCount", 0)
-        original_like_count = original_metrics.get(
-            "like_count", 0
-        ) or original_tweet_data.get("likeCount", 0)
-        original_quote_count = original_metrics.get(
-            "quote_count", 0
-        ) or original_tweet_data.get("quoteCount", 0)
-        original_view_count = original_metrics.get(
-            "impression_count", 0
-        ) or original_tweet_data.get("viewCount", 0)
-        original_bookmark_count = original_tweet_data.get("bookmarkCount", 0)
-
-        # Create and add the original tweet as a regular tweet
-        original_tweet = Tweet(
-            tweet_id=original_tweet_id,
-            username=original_username,
-            created_at=original_created_at,
-            text=original_tweet_data.get("text", ""),
-            url=original_tweet_data.get("url", ""),
-            tweet_type="regular",
-            linked_tweet_id=None,
-            retweet_count=original_retweet_count,
-            reply_count=original_reply_count,
-            like_count=original_like_count,
-            quote_count=original_quote_count,
-            view_count=original_view_count,
-            bookmark_count=original_bookmark_count,
-        )
-        result_tweets.append(original_tweet)
-
-        # NOTE: The text of the retweet gets cut off!!!
-        # Now create the retweet itself
-        retweet_id = str(uuid.uuid4())
-        retweet = Tweet(
-            tweet_id=retweet_id,
-            username=username,
-            created_at=created_at,
-            text=text,
-            url=url,
-            tweet_type="retweet",
-            linked_tweet_id=original_tweet_id,
-            retweet_count=retweet_count,
-            reply_count=reply_count,
-            like_count=like_count,
-            quote_count=quote_count,
-            view_count=view_count,
-            bookmark_count=bookmark_count,
-        )
-        result_tweets.append(retweet)
-
-    elif tweet_data.get("inReplyToId") and tweet_data.get("isReply"):
-        # CASE 2: This is a reply
-        # For replies, we create a placeholder for the original tweet
-        # Note: The API doesn't provide the full original tweet data in the reply context
-
-        # original_tweet_id = str(uuid.uuid4())
-        original_tweet_id = None
-        in_reply_to_username = tweet_data.get("inReplyToUsername", "")
-
-        # Create a placeholder for the original tweet with minimal data
-        # Commenting out the original tweet creation since we don't have the text
-        # ----------------------------------------------------------------------
-        # original_tweet = Tweet(
-        #     tweet_id=original_tweet_id,
-        #     username=in_reply_to_username,
-        #     created_at=created_at - datetime.timedelta(minutes=5),  # Approximate time (earlier)
-        #     text="",  # We don't have the original text
-        #     url="",
-        #     tweet_type="regular",
-        #     linked_tweet_id=None,
-        #     retweet_count=0,
-        #     reply_count=0,
-        #     like_count=0,
-        #     quote_count=0,
-        #     view_count=0,
-        #     bookmark_count=0
-        # )
-        # result_tweets.append(original_tweet)
-
-        # Create the reply tweet
-        reply_id = str(uuid.uuid4())
-        reply = Tweet(
-            tweet_id=reply_id,
-            username=username,
-            created_at=created_at,
-            text=text,
-            url=url,
-            tweet_type="reply",
-            linked_tweet_id=original_tweet_id,
-            retweet_count=retweet_count,
-            reply_count=reply_count,
-            like_count=like_count,
-            quote_count=quote_count,
-            view_count=view_count,
-            bookmark_count=bookmark_count,
-        )
-        result_tweets.append(reply)
+    Args:
+        full_data: Parsed JSON response of the API
+        username: Twitter username the page belongs to
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+        stop_at: Creation time (naive UTC) of the newest tweet already stored for the user.
+            Paging stops once it reaches this tweet.
 
+    Returns:
+        PageResult with the tweet records from the date range and the cursor of the next page
+    """
+    # The API response has tweets in data.tweets, not directly in data
+    if "data" not in full_data or "tweets" not in full_data["data"]:
+        print("No tweets found in response")
+        return PageResult([], None, "end")
+
+    tweets = full_data["data"]["tweets"]
+    page_tweets, embedded, stop_reason = _collect_tweets_in_range(
+        tweets, username, start_date, end_date, stop_at
+    )
+    if stop_reason is not None:
+        return PageResult(page_tweets, None, stop_reason, embedded)
+
+    len_tweets = len(tweets)
+    has_next_page = full_data.get("has_next_page", False)
+
+    # Check if there are more pages
+    if len_tweets == 20 and has_next_page:
+        cursor = full_data.get("next_cursor", "")
+        if cursor == "":
+            raise ValueError(
+                f"No cursor found for {username} but has_next_page is True"
+            )
+        return PageResult(page_tweets, cursor, embedded=embedded)
+
+    if len_tweets != 20 and not has_next_page:
+        print(f"Stopping due to <20 tweets and no more pages for {username}")
+    elif len_tweets != 20:
+        print(f"Stopping due to <20 tweets for {username}")
+    elif not has_next_page:
+        print(f"Stopping due to no more pages for {username}")
     else:
-        # CASE 3: Regular tweet, quoted tweet, or other type
-        tweet_type = "regular"
-        linked_tweet_id = None
-
-        # Check for quoted tweets
-        if tweet_data.get("quoted_tweet"):
-            tweet_type = "quote"
-            # Use a new UUID for the quoted tweet reference
-            linked_tweet_id = str(uuid.uuid4())
-
-        # Create a single regular tweet
-        tweet_id = str(uuid.uuid4())
-        tweet = Tweet(
-            tweet_id=tweet_id,
-            username=username,
-            created_at=created_at,
-            text=text,
-            url=url,
-            tweet_type=tweet_type,
-            linked_tweet_id=linked_tweet_id,
-            retweet_count=retweet_count,
-            reply_count=reply_count,
-            like_count=like_count,
-            quote_count=quote_count,
-            view_count=view_count,
-            bookmark_count=bookmark_count,
+        raise ValueError(
+            f"Not sure why tweets are not 20 and there are no more pages for {username}."
         )
-        result_tweets.append(tweet)
+    return PageResult(page_tweets, None, "end", embedded)
 
-    return result_tweets
+
+def process_search_page(
+    full_data: dict,
+    username: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    stop_at: datetime.datetime | None = None,
+) -> PageResult:
+    """
+    Processes one page of the "advanced_search" endpoint.
+    The search already limits the tweets to the date range, so paging only stops at the
+    end of the results (or at tweets that are already stored).
+
+    Args:
+        full_data: Parsed JSON response of the API
+        username: Twitter username the page belongs to
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+        stop_at: Creation time (naive UTC) of the newest tweet already stored for the user
+
+    Returns:
+        PageResult with the tweet records from the date range and the cursor of the next page
+    """
+    # Search results have the tweets at the top level
+    tweets = full_data.get("tweets") or []
+    page_tweets, embedded, stop_reason = _collect_tweets_in_range(
+        tweets, username, start_date, end_date, stop_at
+    )
+    if stop_reason is not None:
+        return PageResult(page_tweets, None, stop_reason, embedded)
+
+    cursor = full_data.get("next_cursor", "")
+    if tweets and full_data.get("has_next_page", False) and cursor:
+        return PageResult(page_tweets, cursor, embedded=embedded)
+
+    print(f"Reached the end of the search results for {username}")
+    return PageResult(page_tweets, None, "end", embedded)
+
+
+def process_archived_page(
+    full_data: dict,
+    username: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+) -> PageResult:
+    """
+    Processes one archived page of either tweet endpoint for a replay.
+    Replays read every archived page instead of following cursors, so the result never
+    has a next cursor.
+
+    Args:
+        full_data: Parsed JSON response of the API, as it was archived
+        username: Twitter username the page belongs to
+        start_date: First date to collect tweets from
+        end_date: Last date to collect tweets from
+
+    Returns:
+        PageResult with the tweet records from the date range
+    """
+    # Timeline pages have the tweets in data.tweets, search results at the top level
+    tweets = full_data.get("data", {}).get("tweets") or full_data.get("tweets") or []
+    page_tweets, embedded, stop_reason = _collect_tweets_in_range(
+        tweets, username, start_date, end_date
+    )
+    return PageResult(page_tweets, None, stop_reason or "end", embedded)
+
+
+def _collect_tweets_in_range(
+    tweets: list[dict],
+    username: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    stop_at: datetime.datetime | None = None,
+) -> tuple[List[TweetRecord], tuple[TweetRecord, ...], str | None]:
+    """
+    Converts the API tweets of a page that fall in the date range, newest first.
+    Each date is only parsed once and the tweets become lightweight records;
+    Tweet SQLModels are only built when the records are saved.
+
+    Returns:
+        Tuple of the tweet records, the records of the tweets they quote (embedded in
+        the page) and why paging should stop ("date", "stored" or None)
+    """
+    page_tweets = []
+    embedded = []
+
+    for tweet_data in tweets:
+        if "createdAt" in tweet_data:
+            # Parse the tweet date
+            created_at_str = tweet_data["createdAt"]
+            tweet_date = parse_tweet_date(created_at_str)
+            if tweet_date is None:
+                print(f"Warning: Could not parse date: {created_at_str}")
+                continue
+
+            # If tweet is before the start date, stop collecting
+            if tweet_date.date() < start_date:
+                print(
+                    f"Reached tweet from {tweet_date} which is before start date {start_date}"
+                )
+                return page_tweets, tuple(embedded), "date"
+
+            # If we reached tweets that are already stored, stop collecting
+            if stop_at is not None and tweet_date.replace(tzinfo=None) <= stop_at:
+                print(f"Reached already stored tweets for {username} at {tweet_date}")
+                return page_tweets, tuple(embedded), "stored"
+
+            # If tweet is from the date range, add it
+            # Tweets after the end date are skipped
+            if tweet_date.date() <= end_date:
+                # Convert the API tweet to our records
+                page_tweets.extend(convert_api_tweet(tweet_data, tweet_date))
+                quoted = embedded_quoted_tweet(tweet_data)
+                if quoted is not None:
+                    embedded.append(quoted)
+
+    return page_tweets, tuple(embedded), None
@@ -0,0 +1,116 @@
+from typing import Iterable, List
+from db.database import NewsDatabase
+from pydantic_models.tweet_model import Tweet
+from twitter.tweet_records import (
+    TweetRecord,
+    convert_api_tweet,
+    records_to_tweets,
+)
+from twitter.twitter_client import TwitterAPIError, TwitterClient
+
+# Tweet IDs per tweets-by-ID request
+LOOKUP_BATCH_SIZE = 50
+
+
+def find_missing_linked_ids(db: NewsDatabase, tweets: Iterable[Tweet]) -> List[str]:
+    """
+    Find the quoted and replied-to tweets that aren't in the run or the database yet.
+
+    Args:
+        db: Database to check for already stored tweets
+        tweets: Tweets collected in this run
+
+    Returns:
+        Sorted list of the missing tweet IDs
+    """
+    tweets = list(tweets)
+    linked_ids = {
+        tweet.linked_tweet_id
+        for tweet in tweets
+        if tweet.linked_tweet_id and tweet.tweet_type in ("quote", "reply")
+    }
+    linked_ids -= {tweet.tweet_id for tweet in tweets}
+    if not linked_ids:
+        return []
+    stored_ids = {tweet.tweet_id for tweet in db.get_tweets_by_ids(list(linked_ids))}
+    return sorted(linked_ids - stored_ids)
+
+
+def lookup_tweets(
+    client: TwitterClient,
+    tweet_ids: List[str],
+    batch_size: int = LOOKUP_BATCH_SIZE,
+    embedded: Iterable[TweetRecord] = (),
+) -> List[TweetRecord]:
+    """
+    Look up tweets by ID, using the embedded copies first and batching the rest into
+    API calls.
+
+    Args:
+        client: TwitterClient used for the tweets-by-ID requests
+        tweet_ids: IDs of the tweets to look up
+        batch_size: Number of IDs per request
+        embedded: Records of tweets that came embedded in the fetched pages
+
+    Returns:
+        Records of the tweets that were found
+    """
+    embedded_by_id = {record.tweet_id: record for record in embedded}
+    records = [
+        embedded_by_id[tweet_id] for tweet_id in tweet_ids if tweet_id in embedded_by_id
+    ]
+    to_fetch = [tweet_id for tweet_id in tweet_ids if tweet_id not in embedded_by_id]
+
+    for i in range(0, len(to_fetch), batch_size):
+        batch = to_fetch[i : i + batch_size]
+        try:
+            full_data = client.tweets_by_ids(batch)
+        except TwitterAPIError as e:
+            # Nothing is saved for the batch, so the next run tries again
+            print(f"Could not look up {len(batch)} linked tweet(s): {e}")
+            continue
+
+        for tweet_data in full_data.get("tweets") or []:
+            try:
+                converted = convert_api_tweet(tweet_data)
+            except ValueError as e:
+                print(f"Skipping linked tweet: {e}")
+                continue
+            records.extend(converted)
+
+    return records
+
+
+def hydrate_linked_tweets(
+    db: NewsDatabase,
+    tweets: Iterable[Tweet],
+    client: TwitterClient,
+    embedded: Iterable[TweetRecord] = (),
+    batch_size: int = LOOKUP_BATCH_SIZE,
+) -> List[Tweet]:
+    """
+    Store the quoted and replied-to tweets of a run, so the ranker can read them as context.
+
+    Quoted tweets usually come embedded in the fetched pages, reply parents are looked
+    up in batches. Tweets already in the database are not looked up again.
+
+    Args:
+        db: Database the linked tweets are saved to
+        tweets: Tweets collected in this run
+        client: TwitterClient used for the tweets-by-ID requests
+        embedded: Quoted tweets that came embedded in the run's pages (PageResult.embedded)
+        batch_size: Number of IDs per request
+
+    Returns:
+        The linked Tweet objects that were saved
+    """
+    missing_ids = find_missing_linked_ids(db, tweets)
+    if not missing_ids:
+        return []
+
+    linked_tweets = records_to_tweets(lookup_tweets(client, missing_ids, batch_size, embedded))
+    db.save_tweets(linked_tweets)
+    print(
+        f"Hydrated {len(linked_tweets)} linked tweet(s) for {len(missing_ids)} missing ID(s)"
+    )
+    return linked_tweets
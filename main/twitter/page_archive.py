@@ -0,0 +1,98 @@
+import datetime
+import gzip
+import json
+from pathlib import Path
+from typing import Iterator
+from twitter.tweet_records import loads
+
+# Default location of the archive, one file per user
+DEFAULT_ARCHIVE_DIR = Path(__file__).parent / "page_archive"
+
+
+def _params_key(endpoint: str, params: dict) -> str:
+    """Stable key for a request, so the same endpoint and query find the same page"""
+    return endpoint + "?" + json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+class PageArchive:
+    """
+    Compressed, append-only archive of the raw JSON pages returned by twitterapi.io.
+    Every page is stored with the user, endpoint, query (including the cursor) and fetch time,
+    so pages can be re-parsed later without paying for the API again.
+
+    Each user has one gzip file. Every append writes a new gzip member, which keeps the file
+    append-only while it still reads back as a single stream of JSON lines.
+    """
+
+    def __init__(self, archive_dir: str | Path = DEFAULT_ARCHIVE_DIR):
+        self.archive_dir = Path(archive_dir)
+        # Loaded replay indexes: username -> request key -> page
+        self._indexes: dict[str, dict[str, dict]] = {}
+
+    def _user_path(self, username: str) -> Path:
+        return self.archive_dir / f"{username.lower()}.jsonl.gz"
+
+    def append(self, username: str, endpoint: str, params: dict, page: dict) -> None:
+        """
+        Append a fetched page to the user's archive.
+
+        Args:
+            username: Twitter username the page belongs to
+            endpoint: API endpoint the page was fetched from
+            params: Query string parameters, including the cursor
+            page: Parsed JSON response of the API
+        """
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        record = {
+            "fetched_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "username": username,
+            "endpoint": endpoint,
+            "params": params,
+            "page": page,
+        }
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with gzip.open(self._user_path(username), "ab", compresslevel=6) as f:
+            f.write(line.encode("utf-8"))
+
+    def iter_records(self, username: str | None = None) -> Iterator[dict]:
+        """
+        Iterate over the archived page records, oldest fetch first.
+
+        Args:
+            username: Only read this user's archive (defaults to every user)
+
+        Yields:
+            Dictionaries with the fetched_at, username, endpoint, params and page keys
+        """
+        if username is not None:
+            paths = [self._user_path(username)]
+        else:
+            paths = sorted(self.archive_dir.glob("*.jsonl.gz"))
+
+        for path in paths:
+            if not path.exists():
+                continue
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    yield loads(line)
+
+    def lookup(self, username: str, endpoint: str, params: dict) -> dict | None:
+        """
+        Find the most recently fetched page for a request.
+
+        Args:
+            username: Twitter username the page belongs to
+            endpoint: API endpoint of the request
+            params: Query string parameters of the request
+
+        Returns:
+            The archived page, or None if the request was never archived
+        """
+        key = username.lower()
+        if key not in self._indexes:
+            # Later fetches of the same request overwrite earlier ones
+            self._indexes[key] = {
+                _params_key(record["endpoint"], record["params"]): record["page"]
+                for record in self.iter_records(username)
+            }
+        return self._indexes[key].get(_params_key(endpoint, params))
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every request made with one API key.
+    Refills at `rate` tokens per second up to `capacity`, and each request takes one token.
+    Works for both threads and async tasks: a request reserves its token up front and
+    then waits until the token is available, so callers are served in order.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token and return how many seconds to wait until it is available"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        """Block until a token is available"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """Wait without blocking the event loop until a token is available"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_token_bucket(api_key: str, qps: float) -> TokenBucket:
+    """Get the token bucket of an API key, so every client and worker using the key shares it"""
+    with _buckets_lock:
+        bucket = _buckets.get(api_key)
+        if bucket is None or bucket.rate != qps:
+            bucket = TokenBucket(qps)
+            _buckets[api_key] = bucket
+        return bucket
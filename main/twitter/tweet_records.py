@@ -0,0 +1,255 @@
+import datetime
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, List
+from pydantic_models.tweet_model import Tweet
+
+try:
+    import orjson
+
+    def loads(data: bytes | str):
+        """Parse JSON with orjson"""
+        return orjson.loads(data)
+
+except ImportError:  # orjson is optional, fall back to the standard library
+
+    def loads(data: bytes | str):
+        """Parse JSON with the standard library"""
+        return json.loads(data)
+
+
+_MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+    "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12,
+}
+_TIMEZONES: dict[str, datetime.timezone] = {"+0000": datetime.timezone.utc}
+
+def parse_twitter_date(tweet_date: str) -> datetime.datetime | None:
+    """
+    Fast parser for the Twitter date format "Fri May 09 09:55:55 +0000 2025".
+    Splits the string by hand, which is several times faster than strptime.
+
+    Returns:
+        A timezone aware datetime.datetime, or None if the string is not in the Twitter format
+    """
+    try:
+        _, month, day, clock, offset, year = tweet_date.split(" ")
+        hour, minute, second = clock.split(":")
+        tzinfo = _TIMEZONES.get(offset)
+        if tzinfo is None:
+            sign = -1 if offset[0] == "-" else 1
+            tzinfo = datetime.timezone(
+                sign
+                * datetime.timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+            )
+            _TIMEZONES[offset] = tzinfo
+        return datetime.datetime(
+            int(year),
+            _MONTHS[month],
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            tzinfo=tzinfo,
+        )
+    except (ValueError, KeyError, IndexError):
+        return None
+
+
+@dataclass(slots=True)
+class TweetRecord:
+    """
+    Lightweight, slotted version of a Tweet used while parsing pages.
+    Only turned into a Tweet SQLModel when it is saved or handed to the rest of the pipeline.
+    """
+
+    tweet_id: str
+    username: str
+    url: str
+    created_at: datetime.datetime
+    text: str
+    tweet_type: str = "regular"
+    linked_tweet_id: str | None = None
+    retweet_count: int = 0
+    reply_count: int = 0
+    like_count: int = 0
+    quote_count: int = 0
+    view_count: int = 0
+    bookmark_count: int = 0
+
+    def to_tweet(self) -> Tweet:
+        """Build the Tweet SQLModel for this record"""
+        return Tweet(
+            tweet_id=self.tweet_id,
+            username=self.username,
+            url=self.url,
+            created_at=self.created_at,
+            text=self.text,
+            tweet_type=self.tweet_type,
+            linked_tweet_id=self.linked_tweet_id,
+            retweet_count=self.retweet_count,
+            reply_count=self.reply_count,
+            like_count=self.like_count,
+            quote_count=self.quote_count,
+            view_count=self.view_count,
+            bookmark_count=self.bookmark_count,
+        )
+
+
+def records_to_tweets(records: Iterable[TweetRecord]) -> List[Tweet]:
+    """Build the Tweet SQLModels for a batch of records"""
+    return [record.to_tweet() for record in records]
+
+
+def native_tweet_id(tweet_data: dict) -> str | None:
+    """The platform's own ID of an API tweet, as a string"""
+    tweet_id = tweet_data.get("id")
+    return str(tweet_id) if tweet_id else None
+
+
+def _build_record(
+    tweet_data: dict,
+    created_at: datetime.datetime,
+    tweet_type: str,
+    linked_tweet_id: str | None,
+) -> TweetRecord:
+    """Build a record from an API tweet, reading each metric from public_metrics first"""
+    username = tweet_data["author"].get("userName", "")
+    if not username:
+        raise ValueError(f"Username not found! tweet_data:\n{tweet_data}")
+
+    get = tweet_data.get
+    metrics = get("public_metrics") or {}
+    return TweetRecord(
+        # Key tweets by their native ID so the same tweet always gets the same row
+        tweet_id=native_tweet_id(tweet_data) or str(uuid.uuid4()),
+        username=username,
+        url=get("url", ""),
+        created_at=created_at,
+        text=get("text", ""),
+        tweet_type=tweet_type,
+        linked_tweet_id=linked_tweet_id,
+        retweet_count=metrics.get("retweet_count", 0) or get("retweetCount", 0),
+        reply_count=metrics.get("reply_count", 0) or get("replyCount", 0),
+        like_count=metrics.get("like_count", 0) or get("likeCount", 0),
+        quote_count=metrics.get("quote_count", 0) or get("quoteCount", 0),
+        view_count=metrics.get("impression_count", 0) or get("viewCount", 0),
+        bookmark_count=get("bookmarkCount", 0),
+    )
+
+
+def convert_api_tweet(
+    tweet_data: dict, created_at: datetime.datetime | None = None
+) -> List[TweetRecord]:
+    """
+    Converts a tweet from the Twitter API format to our record(s).
+
+    Args:
+        tweet_data: Dictionary containing tweet data from the API
+        created_at: Already parsed creation time of the tweet (parsed here if not given)
+
+    Returns:
+        List of TweetRecords:
+        - For regular and quote tweets: a list with a single record
+        - For retweets: a list with the original tweet and the retweet
+        - For replies: a list with the reply (the API doesn't give us the original's text)
+
+        The quoted tweet of a quote isn't included, see embedded_quoted_tweet.
+
+        Records are keyed by the native tweet ID, and retweets, quotes and replies link to
+        the native ID of their original, so every copy of an original is the same row.
+    """
+    if created_at is None:
+        created_at_str = tweet_data.get("createdAt", "")
+        created_at = parse_twitter_date(created_at_str)
+        if created_at is None:
+            raise ValueError(
+                f"Can't parse date! \ndate: {created_at_str}\n tweet_data:\n{tweet_data}"
+            )
+
+    original_tweet_data = tweet_data.get("retweeted_tweet")
+    if original_tweet_data:
+        # CASE 1: This is a retweet
+        # If we can't parse the date of the original tweet, use the retweet date
+        original_created_at = (
+            parse_twitter_date(original_tweet_data.get("createdAt", "")) or created_at
+        )
+        original = _build_record(original_tweet_data, original_created_at, "regular", None)
+        # NOTE: The text of the retweet gets cut off!!!
+        retweet = _build_record(tweet_data, created_at, "retweet", original.tweet_id)
+        return [original, retweet]
+
+    if tweet_data.get("inReplyToId") and tweet_data.get("isReply"):
+        # CASE 2: This is a reply
+        # The API doesn't provide the original tweet in the reply, only its ID
+        return [
+            _build_record(
+                tweet_data, created_at, "reply", str(tweet_data["inReplyToId"])
+            )
+        ]
+
+    # CASE 3: Regular tweet, quoted tweet, or other type
+    quoted_tweet_data = tweet_data.get("quoted_tweet")
+    if quoted_tweet_data:
+        return [
+            _build_record(
+                tweet_data, created_at, "quote", native_tweet_id(quoted_tweet_data)
+            )
+        ]
+    return [_build_record(tweet_data, created_at, "regular", None)]
+
+
+def embedded_quoted_tweet(tweet_data: dict) -> TweetRecord | None:
+    """
+    The record of the tweet a quote tweet embeds, so hydration can store it without
+    another API call.
+
+    Returns:
+        The quoted tweet's record, or None if the tweet isn't a quote (retweets and
+        replies are converted as such even if they quote) or the quoted tweet is
+        missing its ID, author or date
+    """
+    quoted_tweet_data = tweet_data.get("quoted_tweet")
+    if (
+        not quoted_tweet_data
+        or tweet_data.get("retweeted_tweet")
+        or (tweet_data.get("inReplyToId") and tweet_data.get("isReply"))
+    ):
+        return None
+    if not native_tweet_id(quoted_tweet_data):
+        return None
+    created_at = parse_twitter_date(quoted_tweet_data.get("createdAt", ""))
+    if created_at is None or not (quoted_tweet_data.get("author") or {}).get("userName"):
+        return None
+    return _build_record(quoted_tweet_data, created_at, "regular", None)
+
+
+def benchmark_page_parsing(pages: List[dict], build_models: bool = False) -> dict:
+    """
+    Measure how fast API pages are turned into records.
+
+    Args:
+        pages: Parsed JSON pages (timeline or search responses)
+        build_models: Also build the Tweet SQLModels, to measure the persistence boundary
+
+    Returns:
+        Dictionary with the number of tweets, seconds taken and tweets per second
+    """
+    start_time = time.perf_counter()
+    tweet_count = 0
+    for page in pages:
+        data = page.get("data")
+        tweets = data.get("tweets", []) if data else page.get("tweets") or []
+        for tweet_data in tweets:
+            records = convert_api_tweet(tweet_data)
+            if build_models:
+                records_to_tweets(records)
+            tweet_count += len(records)
+    seconds = time.perf_counter() - start_time
+    return {
+        "tweets": tweet_count,
+        "seconds": seconds,
+        "tweets_per_second": tweet_count / seconds if seconds else 0.0,
+    }
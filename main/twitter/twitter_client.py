@@ -0,0 +1,442 @@
+import asyncio
+import datetime
+import time
+from functools import lru_cache
+from typing import AsyncIterator, Iterator, TYPE_CHECKING
+import httpx
+import yaml
+from twitter.page_archive import PageArchive
+from twitter.tweet_records import loads
+from twitter.rate_limiter import get_token_bucket
+from http_retry import RETRYABLE_STATUS_CODES, backoff_delay, parse_retry_after
+
+if TYPE_CHECKING:
+    from twitter.get_tweets import PageResult
+
+BASE_URL = "https://api.twitterapi.io/twitter"
+
+
+class TwitterAPIError(Exception):
+    """Raised when twitterapi.io answers with a non-200 status code."""
+
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+        super().__init__(f"HTTP {status_code}: {text[:200]}")
+
+
+# Archive name for tweets-by-ID lookups, which don't belong to a tracked user
+LOOKUP_ARCHIVE_USER = "_tweets_by_id"
+# Endpoints a user's tweets are archived under, replayed for each fetch strategy
+ARCHIVED_TWEET_ENDPOINTS = {
+    "timeline": ("/user/last_tweets",),
+    "search": ("/tweet/advanced_search",),
+    "auto": ("/user/last_tweets", "/tweet/advanced_search"),
+}
+# Requests per second allowed per API key, unless "twitter_api_qps" is set in keys/key.yaml
+DEFAULT_QPS = 20.0
+
+
+@lru_cache(maxsize=None)
+def load_twitter_keys(keys_path: str = "keys/key.yaml") -> dict:
+    """Load the keys YAML file (only read once per path)."""
+    with open(keys_path, "r") as f:
+        return yaml.safe_load(f)
+
+
+class TwitterClient:
+    """
+    Reusable client for twitterapi.io.
+    Loads the API key once and keeps a pool of keep-alive connections for both
+    blocking and async requests, so pages do not pay for a new TCP+TLS handshake.
+
+    With an archive every fetched page is stored raw, and in replay mode pages are
+    read back from the archive instead of the network.
+
+    Requests go through a token bucket shared by every client using the same API key.
+    Rate limited (429) and transient 5xx responses are retried with jittered exponential
+    backoff, honouring the Retry-After header.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        max_connections: int = 20,
+        timeout: float = 30.0,
+        archive: PageArchive | None = None,
+        replay: bool = False,
+        qps: float | None = None,
+        max_retries: int = 5,
+    ):
+        if replay and archive is None:
+            raise ValueError("Replay mode needs a page archive to read from")
+        self.archive = archive
+        self.replay = replay
+        if api_key is None and not replay:
+            keys = load_twitter_keys()
+            api_key = keys["twitter_api_io_key"]
+            if qps is None:
+                qps = keys.get("twitter_api_qps", DEFAULT_QPS)
+        if qps is None:
+            qps = DEFAULT_QPS
+        self.headers = {"X-API-Key": api_key or ""}
+        self.rate_limiter = get_token_bucket(api_key or "", qps)
+        self.max_retries = max_retries
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self.timeout = timeout
+        self._client: httpx.Client | None = None
+        self._async_client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.Client:
+        """Lazily create the pooled blocking HTTP client"""
+        if self._client is None:
+            self._client = httpx.Client(
+                base_url=BASE_URL,
+                headers=self.headers,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """Lazily create the pooled async HTTP client (bound to the running event loop)"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                base_url=BASE_URL,
+                headers=self.headers,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._async_client
+
+    def close(self):
+        """Close the blocking HTTP client"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        """Close the async HTTP client so a later event loop gets a fresh one"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def get(self, endpoint: str, params: dict, username: str | None = None) -> dict:
+        """
+        Call a GET endpoint and return the parsed JSON response.
+
+        Args:
+            endpoint: Path relative to the API base URL, e.g. "/user/last_tweets"
+            params: Query string parameters
+            username: User the page belongs to, used to key the page archive
+
+        Returns:
+            The parsed JSON response
+        """
+        if self.replay:
+            return self._replay_page(endpoint, params, username)
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.client.get(endpoint, params=params)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(None, attempt, e))
+                continue
+            if (
+                response.status_code in RETRYABLE_STATUS_CODES
+                and attempt < self.max_retries
+            ):
+                time.sleep(self._retry_delay(response, attempt))
+                continue
+            break
+
+        if response.status_code != 200:
+            raise TwitterAPIError(response.status_code, response.text)
+        full_data = loads(response.content)
+        if self.archive is not None and username:
+            self.archive.append(username, endpoint, params, full_data)
+        return full_data
+
+    async def aget(
+        self, endpoint: str, params: dict, username: str | None = None
+    ) -> dict:
+        """Async version of get"""
+        if self.replay:
+            return self._replay_page(endpoint, params, username)
+
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire_async()
+            try:
+                response = await self.async_client.get(endpoint, params=params)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(None, attempt, e))
+                continue
+            if (
+                response.status_code in RETRYABLE_STATUS_CODES
+                and attempt < self.max_retries
+            ):
+                await asyncio.sleep(self._retry_delay(response, attempt))
+                continue
+            break
+
+        if response.status_code != 200:
+            raise TwitterAPIError(response.status_code, response.text)
+        full_data = loads(response.content)
+        if self.archive is not None and username:
+            self.archive.append(username, endpoint, params, full_data)
+        return full_data
+
+    def _retry_delay(
+        self,
+        response: httpx.Response | None,
+        attempt: int,
+        error: Exception | None = None,
+    ) -> float:
+        """Work out how long to wait before retrying a failed request"""
+        retry_after = parse_retry_after(response.headers) if response is not None else None
+        delay = backoff_delay(attempt, retry_after=retry_after)
+        if response is not None:
+            reason = f"HTTP {response.status_code}"
+        else:
+            reason = f"{type(error).__name__}: {error}"
+        print(
+            f"Twitter API request failed ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+        )
+        return delay
+
+    def _replay_page(self, endpoint: str, params: dict, username: str | None) -> dict:
+        """Read a page from the archive instead of the network"""
+        full_data = None
+        if username:
+            full_data = self.archive.lookup(username, endpoint, params)
+        if full_data is None:
+            raise TwitterAPIError(404, f"Page not in archive: {endpoint} {params}")
+        return full_data
+
+    def last_tweets(self, username: str, cursor: str = "") -> dict:
+        """Get one page of a user's latest tweets"""
+        return self.get(
+            "/user/last_tweets", {"userName": username, "cursor": cursor}, username
+        )
+
+    async def alast_tweets(self, username: str, cursor: str = "") -> dict:
+        """Async version of last_tweets"""
+        return await self.aget(
+            "/user/last_tweets", {"userName": username, "cursor": cursor}, username
+        )
+
+    def advanced_search(
+        self, query: str, cursor: str = "", username: str | None = None
+    ) -> dict:
+        """Get one page of the latest tweets matching an advanced search query"""
+        return self.get(
+            "/tweet/advanced_search",
+            {"query": query, "queryType": "Latest", "cursor": cursor},
+            username,
+        )
+
+    async def aadvanced_search(
+        self, query: str, cursor: str = "", username: str | None = None
+    ) -> dict:
+        """Async version of advanced_search"""
+        return await self.aget(
+            "/tweet/advanced_search",
+            {"query": query, "queryType": "Latest", "cursor": cursor},
+            username,
+        )
+
+    def tweets_by_ids(self, tweet_ids: list[str]) -> dict:
+        """Look up a batch of tweets by their IDs (archived under LOOKUP_ARCHIVE_USER)"""
+        return self.get(
+            "/tweets", {"tweet_ids": ",".join(tweet_ids)}, LOOKUP_ARCHIVE_USER
+        )
+
+    def iter_tweet_pages(
+        self,
+        username: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        cursor: str = "",
+        stop_at: datetime.datetime | None = None,
+    ) -> Iterator["PageResult"]:
+        """
+        Page back through a user's timeline and yield the tweets from the date range,
+        one result per page, until the pages pass the start date.
+
+        Args:
+            username: Twitter username without the @ symbol
+            start_date: First date to collect tweets from
+            end_date: Last date to collect tweets from
+            cursor: Cursor to start paging from ("" for the newest tweets)
+            stop_at: Creation time of the newest tweet already stored for the user
+
+        Yields:
+            PageResult with the Tweet objects from the date range found on each page
+        """
+        # Import here to avoid circular imports
+        from twitter.get_tweets import process_tweet_page
+
+        while cursor is not None:
+            full_data = self.last_tweets(username, cursor)
+            page = process_tweet_page(
+                full_data, username, start_date, end_date, stop_at
+            )
+            cursor = page.next_cursor
+            yield page
+
+    async def aiter_tweet_pages(
+        self,
+        username: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        cursor: str = "",
+        stop_at: datetime.datetime | None = None,
+    ) -> AsyncIterator["PageResult"]:
+        """Async version of iter_tweet_pages"""
+        # Import here to avoid circular imports
+        from twitter.get_tweets import process_tweet_page
+
+        while cursor is not None:
+            full_data = await self.alast_tweets(username, cursor)
+            page = process_tweet_page(
+                full_data, username, start_date, end_date, stop_at
+            )
+            cursor = page.next_cursor
+            yield page
+
+    def iter_search_pages(
+        self,
+        username: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        cursor: str = "",
+        stop_at: datetime.datetime | None = None,
+    ) -> Iterator["PageResult"]:
+        """
+        Yield a user's tweets from the date range using the advanced search endpoint,
+        which only returns the requested window instead of walking the whole timeline.
+
+        Args:
+            username: Twitter username without the @ symbol
+            start_date: First date to collect tweets from
+            end_date: Last date to collect tweets from
+            cursor: Cursor to start paging from ("" for the first page)
+            stop_at: Creation time of the newest tweet already stored for the user
+
+        Yields:
+            PageResult with the Tweet objects found on each page
+        """
+        # Import here to avoid circular imports
+        from twitter.get_tweets import process_search_page
+
+        query = build_search_query(username, start_date, end_date)
+        while cursor is not None:
+            full_data = self.advanced_search(query, cursor, username)
+            page = process_search_page(
+                full_data, username, start_date, end_date, stop_at
+            )
+            cursor = page.next_cursor
+            yield page
+
+    async def aiter_search_pages(
+        self,
+        username: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        cursor: str = "",
+        stop_at: datetime.datetime | None = None,
+    ) -> AsyncIterator["PageResult"]:
+        """Async version of iter_search_pages"""
+        # Import here to avoid circular imports
+        from twitter.get_tweets import process_search_page
+
+        query = build_search_query(username, start_date, end_date)
+        while cursor is not None:
+            full_data = await self.aadvanced_search(query, cursor, username)
+            page = process_search_page(
+                full_data, username, start_date, end_date, stop_at
+            )
+            cursor = page.next_cursor
+            yield page
+
+    def iter_archived_pages(
+        self,
+        username: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        strategy: str = "auto",
+    ) -> Iterator["PageResult"]:
+        """
+        Replay a user's tweets from the date range off every archived page, oldest
+        fetch first. Pages aren't looked up by cursor: the first page of a walk is the
+        same request on every run, so each walk would replace the pages of the earlier
+        ones, and a walk that stopped early at stored tweets has no further pages.
+
+        Args:
+            username: Twitter username without the @ symbol
+            start_date: First date to collect tweets from
+            end_date: Last date to collect tweets from
+            strategy: Replay timeline pages, search pages or ("auto") both
+
+        Yields:
+            PageResult with the Tweet records from each page not seen on an earlier page
+        """
+        # Import here to avoid circular imports
+        from twitter.get_tweets import PageResult, process_archived_page
+
+        endpoints = ARCHIVED_TWEET_ENDPOINTS[strategy]
+        seen_ids = set()
+        for record in self.archive.iter_records(username):
+            if record["endpoint"] not in endpoints:
+                continue
+            page = process_archived_page(record["page"], username, start_date, end_date)
+            # Walks overlap, keep each tweet once
+            new_tweets = [tweet for tweet in page.tweets if tweet.tweet_id not in seen_ids]
+            seen_ids.update(tweet.tweet_id for tweet in new_tweets)
+            yield PageResult(new_tweets, None, page.stop_reason, page.embedded)
+
+    async def aiter_archived_pages(
+        self,
+        username: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        strategy: str = "auto",
+    ) -> AsyncIterator["PageResult"]:
+        """Async version of iter_archived_pages, reading the archive on a worker thread"""
+        pages = await asyncio.to_thread(
+            list, self.iter_archived_pages(username, start_date, end_date, strategy)
+        )
+        for page in pages:
+            yield page
+
+
+def build_search_query(
+    username: str, start_date: datetime.date, end_date: datetime.date
+) -> str:
+    """Build the advanced search query for a user's tweets in the date range (until is exclusive)"""
+    until_date = end_date + datetime.timedelta(days=1)
+    return (
+        f"from:{username} since:{start_date.isoformat()}_00:00:00_UTC "
+        f"until:{until_date.isoformat()}_00:00:00_UTC"
+    )
+
+
+_default_client: TwitterClient | None = None
+
+
+def get_default_client() -> TwitterClient:
+    """Get the process-wide TwitterClient, creating it on first use (archives every page)"""
+    global _default_client
+    if _default_client is None:
+        _default_client = TwitterClient(archive=PageArchive())
+    return _default_client